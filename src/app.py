@@ -60,6 +60,8 @@ import version
 irods_zone_config_module = importlib.import_module(os.getenv('IRODS_ZONES_CONFIG', 'irods_zones_config.py').rstrip('.py'))
 
 import irods_session_pool
+from maintenance import maintenance_mode
+import irods_tracing
 from werkzeug.exceptions import HTTPException, ServiceUnavailable
 
 import datetime
@@ -165,12 +167,18 @@ def init_and_secure_views():
         "static",
     ]:
         return None
-    
+
+    # count and time the catalog calls of this request, if enabled
+    irods_tracing.start_request_tracing()
+
     # First check if there are no calamities and need to interrupt here
-    if os.path.isfile('storage/service-down.txt'):
-        message=''
-        with open('storage/service-down.txt') as f:
-            message=f.read()
+    # admins can still reach the maintenance page to switch it off again
+    if (
+        message := maintenance_mode.get_message()
+    ) is not None and request.endpoint not in [
+        "admin_admin_bp.maintenance",
+        "admin_admin_bp.set_maintenance",
+    ]:
         raise ServiceUnavailable(message)
 
 
@@ -227,6 +235,7 @@ def init_and_secure_views():
             irods_session = iRODSSession(irods_env_file=irods_env_file)
             session["userid"] = irods_session.username
             irods_session_pool.add_irods_session(session["userid"], irods_session)
+            irods_session = irods_session_pool.get_irods_session(session["userid"])
         g.irods_session = irods_session
         print(f"Session id: {session['userid']}")
         g.user_home = f"/{g.irods_session.zone}/home/{irods_session.username}"
@@ -258,6 +267,9 @@ def init_and_secure_views():
                 )
                 irods_session.collections.get(f"/{irods_session.zone}/home")
                 irods_session_pool.add_irods_session(session["userid"], irods_session)
+                irods_session = irods_session_pool.get_irods_session(session["userid"])
+            except ServiceUnavailable:
+                raise
             except:
                 irods_session = None
                 # note we'll leave the session['zone'] parameter for use a hint in the login form
@@ -278,11 +290,29 @@ def init_and_secure_views():
 
 @app.after_request
 def release_irods_session_lock(response):
-    if "userid" in session:
-        irods_session_pool.unlock_irods_session(session["userid"])
+    if "userid" in session and "irods_session" in g:
+        session_id = session["userid"]
+        irods_session = g.irods_session
+        if response.is_streamed:
+            # streamed bodies (downloads) keep using the session until fully sent, up to
+            # SESSION_POOL_STREAMING_MAX outside of the per user pool size so other
+            # requests of the user are not blocked
+            irods_session_pool.release_streamed_irods_session(session_id, irods_session)
+            response.call_on_close(
+                lambda: irods_session_pool.unlock_streamed_irods_session(
+                    session_id, irods_session
+                )
+            )
+        else:
+            irods_session_pool.unlock_irods_session(session_id, irods_session)
     return response
 
 
+@app.after_request
+def add_irods_server_timing(response):
+    return irods_tracing.finish_request_tracing(response)
+
+
 # custom filters
 
 
@@ -2,15 +2,19 @@ from irods.session import iRODSSession
 import irods
 
 # Since PRC 1.1.7
-from irods.user import iRODSGroup
+from irods.user import iRODSGroup, iRODSUser
 from irods.models import Group, User
+from collections.abc import Sequence
 
 
-from threading import Lock, Thread, Event
+from threading import Lock, Thread, Event, Condition
 import datetime, time
+import heapq, itertools
 import logging
+import os
 import signals
 from flask import session, current_app
+from werkzeug.exceptions import ServiceUnavailable
 
 # global pool of irods session as a dict of wrapped iRODSUSerSession objects
 irods_user_sessions = {}
@@ -18,42 +22,281 @@ irods_node_logins = []
 
 SESSION_TTL = 60 * 30  # 30 minutes
 
+# bounds for the number of parallel iRODS sessions (connections) a single user can use
+SESSION_POOL_MIN = int(os.environ.get("MANGO_SESSION_POOL_MIN", 1))
+SESSION_POOL_MAX = int(os.environ.get("MANGO_SESSION_POOL_MAX", 4))
+# streamed responses (downloads) of a single user that release their session from the pool
+# bound above, further streamed responses keep theirs checked out until fully sent
+SESSION_POOL_STREAMING_MAX = int(
+    os.environ.get("MANGO_SESSION_POOL_STREAMING_MAX", SESSION_POOL_MAX)
+)
+# max seconds a request waits for a free session when all SESSION_POOL_MAX are checked out
+SESSION_POOL_CHECKOUT_TIMEOUT = float(
+    os.environ.get("MANGO_SESSION_POOL_CHECKOUT_TIMEOUT", 30)
+)
+
+# zone wide cache of the catalog user and group membership, keyed on (zone, username)
+USER_GROUPS_TTL = int(os.environ.get("MANGO_USER_GROUPS_TTL", 600))
+user_groups_cache = {}
+
+
+def get_user_catalog_rows(irods_session: iRODSSession):
+    """Returns the cached (user row, group rows) for the session user, queried on a cache miss"""
+    key = (irods_session.zone, irods_session.username)
+    if (cached := user_groups_cache.get(key)) and cached[0] > time.time():
+        return cached[1]
+    user_row = (
+        irods_session.query(User)
+        .filter(User.name == irods_session.username)
+        .filter(User.zone == irods_session.zone)
+        .one()
+    )
+    group_rows = [
+        row
+        for row in irods_session.query(Group)
+        .filter(User.name == irods_session.username)
+        .all()
+        if row[Group.name] != irods_session.username
+    ]
+    group_rows.sort(key=lambda row: row[Group.name])
+    user_groups_cache[key] = (time.time() + USER_GROUPS_TTL, (user_row, group_rows))
+    return (user_row, group_rows)
+
+
+def invalidate_user_groups(zone, username=None):
+    """Forget the cached membership of a user, or of all users of the zone if no username is given"""
+    for key in list(user_groups_cache):
+        if key[0] == zone and (username is None or key[1] == username):
+            user_groups_cache.pop(key, None)
+
+
+class LazyUserGroups(Sequence):
+    """Group membership of the session user, only resolved when first used
+
+    With attribute set, the sequence holds that attribute (id, name) of each group
+    instead of the iRODSGroup objects.
+    """
+
+    def __init__(self, irods_session: iRODSSession, attribute=None):
+        self.irods_session = irods_session
+        self.attribute = attribute
+
+    def _items(self):
+        (_, group_rows) = get_user_catalog_rows(self.irods_session)
+        groups = [iRODSGroup(self.irods_session.user_groups, row) for row in group_rows]
+        if self.attribute:
+            return [getattr(group, self.attribute) for group in groups]
+        return groups
+
+    def __getitem__(self, index):
+        return self._items()[index]
+
+    def __len__(self):
+        return len(self._items())
+
+    def __iter__(self):
+        return iter(self._items())
+
+    def __contains__(self, value):
+        return value in self._items()
+
+
+class LazyCatalogUser:
+    """iRODSUser of the session user, only resolved when one of its attributes is used"""
+
+    def __init__(self, irods_session: iRODSSession):
+        self.irods_session = irods_session
+
+    def __getattr__(self, name):
+        (user_row, _) = get_user_catalog_rows(self.irods_session)
+        return getattr(iRODSUser(self.irods_session.users, user_row), name)
+
+
+def bind_lazy_attributes(irods_session: iRODSSession):
+    """Lazy user and group attributes resolved with irods_session itself
+
+    clone() copies attributes shallowly, every clone needs its own, otherwise lookups run
+    on the session that was cloned while another request may have it checked out
+    """
+    irods_session.user = LazyCatalogUser(irods_session)
+    irods_session.my_groups = LazyUserGroups(irods_session)
+    irods_session.my_group_ids = LazyUserGroups(irods_session, "id")
+    irods_session.my_group_names = LazyUserGroups(irods_session, "name")
+    return irods_session
+
+
+def clone_session(irods_session: iRODSSession) -> iRODSSession:
+    return bind_lazy_attributes(irods_session.clone())
+
+
 class iRODSUserSession(iRODSSession):
     def __init__(self, irods_session: iRODSSession, openid_user_name = None, openid_user_email = None):
         self.irods_session = irods_session
-        self.lock = Lock()
+        # per user pool: the initial session is the template for the clones
+        self.pool_condition = Condition()
+        self.idle_sessions = [irods_session]
+        self.busy_sessions = []
+        # serving streamed responses (downloads), bound by SESSION_POOL_STREAMING_MAX
+        self.streaming_sessions = []
         self.created = datetime.datetime.now()
         self.last_accessed = datetime.datetime.now()
-        self.irods_session.user = self.user = irods_session.users.get(
-            irods_session.username
-        )
-        my_groups = [
-            iRODSGroup(irods_session.user_groups, item)
-            for item in irods_session.query(Group)
-            .filter(User.name == irods_session.username)
-            .all()
-        ]
-        self.irods_session.my_groups = self.my_groups = [
-            group for group in my_groups if group.name != irods_session.username
-        ]
-        self.my_groups.sort(key=lambda x: x.name)
-
-        self.irods_session.my_group_ids = self.my_group_ids = [
-            group.id for group in self.my_groups
-        ]
-        self.irods_session.my_group_names = self.my_group_names = [
-            group.name for group in self.my_groups
-        ]
+        # no catalog queries here, user and groups are looked up when first needed
+        bind_lazy_attributes(irods_session)
+        self.user = irods_session.user
+        self.my_groups = irods_session.my_groups
+        self.my_group_ids = irods_session.my_group_ids
+        self.my_group_names = irods_session.my_group_names
 
         if openid_user_name:
             self.irods_session.openid_user_name = self.openid_user_name = openid_user_name
         if openid_user_email:
             self.irods_session.openid_user_email = self.openid_user_email = openid_user_email
 
+    @property
+    def pool_size(self):
+        return len(self.idle_sessions) + len(self.busy_sessions)
+
+    def in_use(self):
+        return len(self.busy_sessions) > 0 or len(self.streaming_sessions) > 0
+
+    def fill_pool(self, minimum=SESSION_POOL_MIN):
+        """Pre-create clones up to the minimum pool size, connections are made lazily by PRC"""
+        with self.pool_condition:
+            while self.pool_size < minimum:
+                self.idle_sessions.append(clone_session(self.irods_session))
+
+    def checkout(self, timeout=SESSION_POOL_CHECKOUT_TIMEOUT) -> iRODSSession:
+        """Get an iRODS session for exclusive use by a single request
+
+        A clone of the initial session is created if none is idle and the pool is
+        not yet at SESSION_POOL_MAX, otherwise wait at most timeout seconds
+        for another request to check in its session.
+        """
+        with self.pool_condition:
+            if not self.idle_sessions and self.pool_size < SESSION_POOL_MAX:
+                self.idle_sessions.append(clone_session(self.irods_session))
+                logging.info(
+                    f"Session pool {self.irods_session.username}: grown to {self.pool_size} sessions"
+                )
+            if not self.pool_condition.wait_for(
+                lambda: len(self.idle_sessions) > 0, timeout=timeout
+            ):
+                return None
+            irods_session = self.idle_sessions.pop()
+            self.busy_sessions.append(irods_session)
+            self.last_accessed = datetime.datetime.now()
+            return irods_session
+
+    def checkout_spare(self) -> iRODSSession:
+        """An idle session for background work, or None if none is idle right now
+
+        Does not grow the pool and does not count as user activity, so background work
+        neither takes connections from requests nor keeps the session from expiring.
+        """
+        with self.pool_condition:
+            if not self.idle_sessions:
+                return None
+            irods_session = self.idle_sessions.pop()
+            self.busy_sessions.append(irods_session)
+            return irods_session
+
+    def checkin(self, irods_session: iRODSSession, touch=True):
+        with self.pool_condition:
+            if irods_session in self.busy_sessions:
+                self.busy_sessions.remove(irods_session)
+                self.idle_sessions.append(irods_session)
+                if touch:
+                    self.last_accessed = datetime.datetime.now()
+                self.pool_condition.notify()
+
+    def release_for_streaming(self, irods_session: iRODSSession):
+        """The checked out session keeps serving a streamed response
+
+        It no longer counts for the pool size, a long download does not keep the other
+        requests of the user waiting for a session. Once SESSION_POOL_STREAMING_MAX
+        sessions are streaming it stays checked out, the connections of a user remain
+        bound by SESSION_POOL_MAX + SESSION_POOL_STREAMING_MAX.
+        """
+        with self.pool_condition:
+            if (
+                irods_session in self.busy_sessions
+                and len(self.streaming_sessions) < SESSION_POOL_STREAMING_MAX
+            ):
+                self.busy_sessions.remove(irods_session)
+                self.streaming_sessions.append(irods_session)
+                self.pool_condition.notify()
+
+    def checkin_streamed(self, irods_session: iRODSSession):
+        """Back into the pool once the streamed response is sent, if the pool has room"""
+        with self.pool_condition:
+            if irods_session not in self.streaming_sessions:
+                # not released as too many were streaming, still checked out
+                self.checkin(irods_session)
+                return
+            self.streaming_sessions.remove(irods_session)
+            if self.pool_size < SESSION_POOL_MAX:
+                self.idle_sessions.append(irods_session)
+                self.pool_condition.notify()
+                return
+        irods_session.cleanup()
+
     def __del__(self):
         # release connections upon object destruction
         logging.info(f"Session {self.irods_session.username} going away, bye!")
-        self.irods_session.cleanup()
+        for irods_session in (
+            self.idle_sessions + self.busy_sessions + self.streaming_sessions
+        ):
+            irods_session.cleanup()
+
+
+class SessionExpiryIndex:
+    """Min-heap of user session expiry deadlines
+
+    Accessing a session only updates its last_accessed attribute, heap entries are
+    re-scheduled lazily when they come due. The cleanup thus only visits sessions
+    whose deadline has passed instead of every session every second.
+    """
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = datetime.timedelta(seconds=ttl)
+        self.heap = []
+        # tie breaker for equal deadlines, the user sessions themselves are not comparable
+        self.counter = itertools.count()
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def _push(self, deadline, session_id, user_session):
+        heapq.heappush(
+            self.heap, (deadline, next(self.counter), session_id, user_session)
+        )
+
+    def schedule(self, session_id, user_session):
+        with self.lock:
+            self._push(user_session.last_accessed + self.ttl, session_id, user_session)
+
+    def expire(self, user_sessions: dict, current_time: datetime.datetime):
+        """Removes the due sessions from user_sessions and returns them"""
+        expired = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= current_time:
+                (_, _, session_id, user_session) = heapq.heappop(self.heap)
+                # removed or replaced by a new login in the meantime
+                if user_sessions.get(session_id) is not user_session:
+                    continue
+                if user_session.in_use():
+                    # check in will update last_accessed, recomputed when due again
+                    self._push(current_time + self.ttl, session_id, user_session)
+                elif (deadline := user_session.last_accessed + self.ttl) > current_time:
+                    self._push(deadline, session_id, user_session)
+                else:
+                    del user_sessions[session_id]
+                    expired.append(user_session)
+        return expired
+
+
+session_expiry_index = SessionExpiryIndex()
 
 
 class SessionCleanupThread(Thread):
@@ -76,21 +319,13 @@ class SessionCleanupThread(Thread):
             if self.stopped():
                 return
 
-            current_time = datetime.datetime.now()
-            irods_user_sessions = {
-                session_id: user_session
-                for session_id, user_session in irods_user_sessions.items()
-                if (current_time - user_session.last_accessed).total_seconds()
-                < SESSION_TTL
-                or user_session.lock.locked()
-            }
-
-            # for session_id, user_session in irods_user_sessions.items():
-            #     session_age = (current_time - user_session.last_accessed).total_seconds()
-            #     logging.info(f"Inspecting for {session_id}: age={session_age}, lock state={user_session.lock.locked()}")
-            #     if session_age > SESSION_TTL and not user_session.lock.locked():
-            #         del irods_user_sessions[session_id]
-            #         logging.info(f"Removed {session_id}")
+            expired = session_expiry_index.expire(
+                irods_user_sessions, datetime.datetime.now()
+            )
+            for user_session in expired:
+                logging.info(
+                    f"Session cleanup: expired session for {user_session.irods_session.username}"
+                )
             time.sleep(1)
             # emit a heartbeat logging at most every 300 seconds
             if time.time() - self.heartbeat_time > 300:
@@ -101,43 +336,66 @@ class SessionCleanupThread(Thread):
 
 def add_irods_session(session_id, irods_session: iRODSSession, openid_user_name = None, openid_user_email = None):
     global irods_user_sessions
-    irods_user_sessions[session_id] = iRODSUserSession(irods_session, openid_user_name, openid_user_email)
-    irods_user_sessions[session_id].lock.acquire()
+    user_session = iRODSUserSession(irods_session, openid_user_name, openid_user_email)
+    with session_expiry_index.lock:
+        irods_user_sessions[session_id] = user_session
+    session_expiry_index.schedule(session_id, user_session)
     signals.session_pool_user_session_created.send(
         current_app._get_current_object(),
         zone=irods_session.zone,
         username=irods_session.username,
     )
+    # clone only after the listeners had the chance to enrich the initial session
+    irods_user_sessions[session_id].fill_pool()
 
 
 def get_irods_session(session_id):
+    """Check out a session from the user pool, to be handed back with unlock_irods_session"""
     global irods_user_sessions
     if session_id in irods_user_sessions:
-        if not irods_user_sessions[session_id].lock.locked():
-            irods_user_sessions[session_id].lock.acquire()
-            irods_user_sessions[session_id].last_accessed = datetime.datetime.now()
-        return irods_user_sessions[session_id].irods_session
+        irods_session = irods_user_sessions[session_id].checkout()
+        if irods_session is None:
+            raise ServiceUnavailable(
+                "Too many simultaneous requests for your session, please try again"
+            )
+        return irods_session
     else:
         return None
 
 
+def peek_irods_session(session_id):
+    """Returns the initial session of a user pool without checking it out"""
+    global irods_user_sessions
+    if session_id in irods_user_sessions:
+        return irods_user_sessions[session_id].irods_session
+    return None
+
+
 def has_irods_session(session_id):
     global irods_user_sessions
     return session_id in irods_user_sessions
 
 
-def unlock_irods_session(session_id):
+def unlock_irods_session(session_id, irods_session: iRODSSession):
     global irods_user_sessions
-    if (
-        session_id in irods_user_sessions
-        and irods_user_sessions[session_id].lock.locked()
-    ):
-        irods_user_sessions[session_id].lock.release()
+    if session_id in irods_user_sessions and irods_session is not None:
+        irods_user_sessions[session_id].checkin(irods_session)
+
+
+def release_streamed_irods_session(session_id, irods_session: iRODSSession):
+    """For a session that serves a streamed response, see unlock_streamed_irods_session"""
+    if session_id in irods_user_sessions and irods_session is not None:
+        irods_user_sessions[session_id].release_for_streaming(irods_session)
+
+
+def unlock_streamed_irods_session(session_id, irods_session: iRODSSession):
+    if session_id in irods_user_sessions and irods_session is not None:
+        irods_user_sessions[session_id].checkin_streamed(irods_session)
 
 
 def remove_irods_session(session_id):
-    if session_id in irods_user_sessions:
-        del irods_user_sessions[session_id]
+    with session_expiry_index.lock:
+        irods_user_sessions.pop(session_id, None)
 
 
 def check_and_restart_cleanup():
@@ -0,0 +1,176 @@
+# Per request instrumentation of the catalog calls made through the python irods client (PRC)
+#
+# When enabled (env MANGO_IRODS_TRACING=enabled), GenQuery executions and the collection,
+# data object, ACL, metadata and user manager calls are counted and timed for the current
+# request. The totals are sent back as Server-Timing headers and logged as a single json
+# line, repeated identical calls above a threshold are flagged as probable N+1 patterns.
+
+import os
+import time
+import json
+import logging
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_app_context, request
+
+from irods.query import Query
+from irods.manager.collection_manager import CollectionManager
+from irods.manager.data_object_manager import DataObjectManager
+from irods.manager.access_manager import AccessManager
+from irods.manager.metadata_manager import MetadataManager
+from irods.manager.user_manager import UserManager, GroupManager
+
+MANGO_IRODS_TRACING = os.getenv("MANGO_IRODS_TRACING", "disabled").lower() == "enabled"
+# same call signature seen at least this many times within one request is reported as N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("MANGO_IRODS_TRACING_N_PLUS_ONE_THRESHOLD", 10))
+
+TRACED_METHODS = {
+    "collection": (CollectionManager, ["get", "exists", "create", "remove", "move"]),
+    "data_object": (
+        DataObjectManager,
+        ["get", "exists", "open", "put", "create", "copy", "move", "unlink", "chksum"],
+    ),
+    "acl": (AccessManager, ["get", "set"]),
+    "metadata": (
+        MetadataManager,
+        ["get", "add", "remove", "set", "apply_atomic_operations"],
+    ),
+    "user": (UserManager, ["get"]),
+    "group": (GroupManager, ["get", "getmembers", "addmember", "removemember"]),
+}
+
+
+class RequestTracer:
+    """Collects the PRC calls of one request
+
+    Only the outermost call is timed, so a collections.get and the GenQuery it runs
+    internally count once, as collection call. The GenQuery round trips are counted
+    separately at any depth.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.calls = Counter()
+        self.durations = defaultdict(float)
+        self.signatures = Counter()
+        self.round_trips = 0
+        self.lock = threading.Lock()
+        # nesting depth per thread, requests may fan out to worker threads
+        self.local = threading.local()
+
+    @contextmanager
+    def trace(self, category, signature):
+        depth = getattr(self.local, "depth", 0)
+        self.local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.local.depth = depth
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                if category == "query":
+                    self.round_trips += 1
+                if depth == 0:
+                    self.calls[category] += 1
+                    self.durations[category] += elapsed
+                    self.signatures[signature] += 1
+
+    def n_plus_one_suspects(self, threshold=N_PLUS_ONE_THRESHOLD):
+        return {
+            signature: count
+            for signature, count in self.signatures.items()
+            if count >= threshold
+        }
+
+    def server_timing(self):
+        entries = [
+            f'irods-{category};dur={1000 * self.durations[category]:.1f};desc="{count} calls"'
+            for category, count in self.calls.items()
+        ]
+        entries.append(
+            f'irods;dur={1000 * sum(self.durations.values()):.1f};desc="{self.round_trips} queries"'
+        )
+        entries.append(f"app;dur={1000 * (time.perf_counter() - self.start):.1f}")
+        return ", ".join(entries)
+
+    def as_dict(self):
+        return {
+            "calls": dict(self.calls),
+            "durations_ms": {
+                category: round(1000 * duration, 1)
+                for category, duration in self.durations.items()
+            },
+            "round_trips": self.round_trips,
+            "total_ms": round(1000 * (time.perf_counter() - self.start), 1),
+            "n_plus_one": self.n_plus_one_suspects(),
+        }
+
+
+def get_request_tracer():
+    if has_app_context():
+        return g.get("irods_tracer", None)
+    return None
+
+
+def query_signature(query: Query):
+    columns = ",".join(str(column.icat_key) for column in query.columns)
+    conditions = ",".join(str(criterion.query_key.icat_key) for criterion in query.criteria)
+    return f"query[{columns}|{conditions}]"
+
+
+def traced(category, function, signature=None):
+    @wraps(function)
+    def wrapper(self, *args, **kwargs):
+        tracer = get_request_tracer()
+        if tracer is None:
+            return function(self, *args, **kwargs)
+        with tracer.trace(
+            category,
+            signature(self) if signature else f"{category}.{function.__name__}",
+        ):
+            return function(self, *args, **kwargs)
+
+    wrapper.mango_traced = True
+    return wrapper
+
+
+def instrument_prc():
+    """Wraps the PRC calls once, they only record something while a request tracer is active"""
+    if getattr(Query.execute, "mango_traced", False):
+        return
+    Query.execute = traced("query", Query.execute, signature=query_signature)
+    for category, (manager_class, methods) in TRACED_METHODS.items():
+        for method in methods:
+            setattr(
+                manager_class, method, traced(category, getattr(manager_class, method))
+            )
+
+
+def start_request_tracing():
+    if MANGO_IRODS_TRACING:
+        g.irods_tracer = RequestTracer()
+
+
+def finish_request_tracing(response):
+    tracer = get_request_tracer()
+    if tracer is None:
+        return response
+    response.headers.add("Server-Timing", tracer.server_timing())
+    trace = tracer.as_dict()
+    trace["endpoint"] = request.endpoint
+    trace["path"] = request.path
+    trace["status"] = response.status_code
+    logging.info(f"irods_trace {json.dumps(trace)}")
+    if trace["n_plus_one"]:
+        logging.warning(
+            f"Possible N+1 catalog access pattern in {request.endpoint}: {trace['n_plus_one']}"
+        )
+    return response
+
+
+if MANGO_IRODS_TRACING:
+    instrument_prc()
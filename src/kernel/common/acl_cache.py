@@ -0,0 +1,118 @@
+# ACL lookups reused within a request and for a short while per user
+#
+# A view asks for the ACLs of its item more than once (the permission table, the rights of
+# the current user, the owner check before atomic metadata operations). ACLs are read with
+# a single GenQuery and their user ids are resolved through the zone user directory. The
+# result is kept on the request (flask g) keyed on the item id, and in the shared cache
+# per user for MANGO_ACL_CACHE_TTL seconds (0 disables). The permissions_changed signal
+# drops every cached ACL of the zone, ACL changes made outside the portal show up after
+# the TTL.
+
+import os
+
+from flask import g, has_app_context
+from irods.access import iRODSAccess
+from irods.data_object import iRODSDataObject
+from irods.models import Collection, CollectionAccess, DataObject, DataAccess
+
+import signals
+from cache import cache
+from kernel.common.user_directory import get_entries
+
+MANGO_ACL_CACHE_TTL = int(os.environ.get("MANGO_ACL_CACHE_TTL", 30))
+
+
+def item_key(item):
+    kind = "data_object" if isinstance(item, iRODSDataObject) else "collection"
+    return f"{kind}/{item.id}"
+
+
+def request_cache() -> dict:
+    if not has_app_context():
+        return {}
+    if "acl_cache" not in g:
+        g.acl_cache = {}
+    return g.acl_cache
+
+
+def shared_cache_key(irods_session, item):
+    zone = irods_session.zone
+    generation = cache.get(f"acl_cache_generation/{zone}") or 0
+    return f"acl_cache/{generation}/{zone}/{irods_session.username}/{item_key(item)}"
+
+
+def query_acls(irods_session, item, acl_users=None):
+    """The raw ACLs of item as acls.get reports them, without caching
+
+    A list passed as acl_users is extended with the DirectoryEntry (id, name, type, zone)
+    of every user and group holding an ACL
+    """
+    if isinstance(item, iRODSDataObject):
+        collection_path, _, name = item.path.rpartition("/")
+        query = irods_session.query(DataAccess.user_id, DataAccess.name).filter(
+            Collection.name == collection_path, DataObject.name == name
+        )
+        user_id_column, access_column = DataAccess.user_id, DataAccess.name
+    else:
+        query = irods_session.query(
+            CollectionAccess.user_id, CollectionAccess.name
+        ).filter(Collection.name == item.path)
+        user_id_column, access_column = CollectionAccess.user_id, CollectionAccess.name
+    # data objects have a row per replica
+    rows = list(
+        dict.fromkeys((row[user_id_column], row[access_column]) for row in query)
+    )
+    # ids of removed users can linger in the ACL tables, these are left out
+    users = get_entries(irods_session, set(user_id for (user_id, _) in rows))
+    if acl_users is not None:
+        acl_users.extend(users.values())
+    return [
+        iRODSAccess(
+            access_name,
+            item.path,
+            users[user_id].name,
+            users[user_id].zone,
+            users[user_id].type,
+        )
+        for (user_id, access_name) in rows
+        if user_id in users
+    ]
+
+
+def load_acls(irods_session, item):
+    acl_users = []
+    permissions = query_acls(irods_session, item, acl_users=acl_users)
+    return (permissions, acl_users)
+
+
+def get_acls(irods_session, item, acl_users=None):
+    """irods_session.acls.get(item) with raw ACLs, looked up once per request and TTL
+
+    As with acls.get, a list passed as acl_users is extended with the users and groups
+    holding an ACL, as user directory entries (id, name, type, zone)
+    """
+    requested = request_cache()
+    if (entry := requested.get(item_key(item), None)) is None:
+        if MANGO_ACL_CACHE_TTL > 0:
+            key = shared_cache_key(irods_session, item)
+            if (entry := cache.get(key)) is None:
+                entry = load_acls(irods_session, item)
+                cache.set(key, entry, timeout=MANGO_ACL_CACHE_TTL)
+        else:
+            entry = load_acls(irods_session, item)
+        requested[item_key(item)] = entry
+    permissions, users = entry
+    if acl_users is not None:
+        acl_users.extend(users)
+    return list(permissions)
+
+
+def permissions_changed_listener(sender, **parameters):
+    if has_app_context():
+        g.pop("acl_cache", None)
+    if "irods_session" in parameters:
+        key = f"acl_cache_generation/{parameters['irods_session'].zone}"
+        cache.set(key, (cache.get(key) or 0) + 1, timeout=0)
+
+
+signals.permissions_changed.connect(permissions_changed_listener)
@@ -22,6 +22,8 @@ from irods.data_object import iRODSDataObject
 from irods.collection import iRODSCollection
 from irods.session import iRODSSession
 from irods.path import iRODSPath
+from irods.query import Query
+from irods.models import Collection, CollectionMeta
 
 from PIL import Image
 from pdf2image import convert_from_path
@@ -34,7 +36,48 @@ from lib.util import (
     flatten_josse_schema,
     get_collection_size,
     flatten_schema,
+    resolve_paths,
+    resolve_subtree_data_objects,
+    get_type_for_path,
 )
+from lib.parallel import run_lookups
+from lib.streaming import render_view, MANGO_STREAM_TEMPLATES
+from kernel.common.conditional import (
+    view_etag,
+    collection_fingerprint,
+    data_object_fingerprint,
+    is_not_modified,
+    not_modified,
+    with_etag,
+)
+from kernel.common.listing import (
+    list_collection_contents,
+    stream_collection_listing,
+    parse_listing_args,
+    listing_row_to_dict,
+    tree_to_treeselect,
+)
+from lib.compression import gzip_response
+from lib.byte_ranges import data_object_response
+from lib.streaming_archive import (
+    ArchiveEntry,
+    ARCHIVE_FORMATS,
+    archive_response,
+    data_object_chunks,
+)
+from kernel.common import (
+    listing_cache,
+    acl_cache,
+    upload,
+    resumable_upload,
+    bulk_jobs,
+)
+from kernel.common.mime_detection import (
+    MANGO_ASYNC_MIME_DETECTION,
+    queue_mime_detection,
+)
+from kernel.common.prefetch import prefetch_after_response
+from concurrent.futures import TimeoutError
 import magic
 import os
 import glob
@@ -51,8 +94,8 @@ import logging
 import irods_session_pool
 from multidict import MultiDict
 from operator import itemgetter
+from functools import partial
 from pathlib import PurePath, Path
-import tarfile
 
 from kernel.metadata_schema import get_schema_manager
 from kernel.template_overrides import get_template_override_manager
@@ -216,37 +259,15 @@ def group_prefix_metadata_items(
 
 
 # @cache.memoize(1200)
-def get_current_user_rights(current_user_name, item):
+def get_current_user_rights(current_user_name, item, permissions=None):
 
-    permissions = g.irods_session.acls.get(item)
+    if permissions is None:
+        permissions = acl_cache.get_acls(g.irods_session, item)
     access = [permission.access_name for permission in permissions]
 
     return access
 
 
-def rm_pathlib_tree(directory_path: Path):
-    if directory_path.is_dir():
-        for child in directory_path.iterdir():
-            if child.is_file():
-                child.unlink()
-            else:
-                rm_pathlib_tree(child)
-        directory_path.rmdir()
-
-
-def read_file_in_chunks(file_posix_path: str, delete_after=False):
-    CHUNK_SIZE = 4 * 1024 * 1024
-    with open(file_posix_path, "rb") as fd:
-        while 1:
-            buf = fd.read(CHUNK_SIZE)
-            if buf:
-                yield buf
-            else:
-                break
-    if delete_after:
-        os.remove(file_posix_path)
-
-
 def index():
     return render_template(
         "index.html.j2",
@@ -286,8 +307,59 @@ def collection_browse(collection):
         current_collection = g.irods_session.collections.get(co_path)
     except:
         abort(404, "Path not found or not accessible for you")
-    sub_collections = current_collection.subcollections
-    data_objects = current_collection.data_objects
+
+    view_template = get_template_override_manager(
+        g.irods_session.zone
+    ).get_template_for_catalog_item(
+        current_collection, "common/collection_view.html.j2"
+    )
+    etag = view_etag(
+        lambda: collection_fingerprint(g.irods_session, co_path), view_template
+    )
+    if is_not_modified(etag):
+        return not_modified(etag)
+
+    page, page_size, sort, order = parse_listing_args(
+        request.args, allow_unpaged=MANGO_STREAM_TEMPLATES
+    )
+
+    # independent catalog lookups, run concurrently in parallel lookup mode
+    acl_users = []
+    try:
+        lookups = run_lookups(
+            {
+                # page_size 0: complete listing, rows are fetched while streaming
+                "listing": lambda: (
+                    stream_collection_listing(g.irods_session, co_path, order)
+                    if page_size == 0
+                    else listing_cache.get_collection_page(
+                        g.irods_session, co_path, page, page_size, sort, order
+                    )
+                ),
+                "metadata_items": lambda: listing_cache.get_collection_metadata(
+                    g.irods_session, current_collection
+                ),
+                "permissions": lambda: acl_cache.get_acls(
+                    g.irods_session, current_collection, acl_users=acl_users
+                ),
+                # iterated, all() holds only the first GenQuery batch of 500 rows
+                "collection_meta": lambda: list(
+                    Query(g.irods_session, CollectionMeta).filter(
+                        Collection.name == co_path
+                    )
+                ),
+            }
+        )
+    except TimeoutError:
+        abort(504, f"Catalog lookups for {co_path} took too long")
+    listing = lookups["listing"]
+    sub_collections = listing.sub_collections
+    data_objects = listing.data_objects
+    if page_size:
+        # not for the streamed complete listing, its rows are fetched while rendering
+        prefetch_after_response(
+            [sub_collection.path for sub_collection in sub_collections]
+        )
 
     schemas = {}
     schema_manager = False
@@ -302,7 +374,7 @@ def collection_browse(collection):
     
     other = current_app.config["MANGO_NOSCHEMA_LABEL"]
     grouped_metadata = group_prefix_metadata_items(
-        current_collection.metadata(timestamps=True).items(),
+        lookups["metadata_items"],
         current_app.config["MANGO_SCHEMA_PREFIX"],
         schemas=list(schemas.keys()),
     )
@@ -370,10 +442,7 @@ def collection_browse(collection):
     #     else:
     #         sorted_metadata[schema] = grouped_metadata[schema]
     # pprint.pprint(sorted_metadata)
-    acl_users = []
-    permissions = g.irods_session.acls.get(
-        current_collection, acl_users=acl_users
-    )
+    permissions = lookups["permissions"]
     # print(f"Older permissions")
     # pprint.pprint(permissions)
 
@@ -386,36 +455,23 @@ def collection_browse(collection):
 
     my_groups = g.irods_session.my_groups
     # temp: look up metadata items in full, including create_time and modify_time
-    from irods.query import Query
-    from irods.column import Criterion, In
-    from irods.models import CollectionMeta
-
-    objects = [CollectionMeta]
-    filters = []
-    avu_ids = [metadata.avu_id for (_, metadata) in grouped_metadata[other].items()]
-    metadata_objects = []
-    if avu_ids:
-        filters += [In(CollectionMeta.id, avu_ids)]
-
-        query = Query(g.irods_session, *objects).filter(*filters)
-        metadata_objects = query.execute()
-
+    avu_ids = {metadata.avu_id for (_, metadata) in grouped_metadata[other].items()}
+    metadata_objects = [
+        row for row in lookups["collection_meta"] if row[CollectionMeta.id] in avu_ids
+    ]
     # end temp
-    view_template = get_template_override_manager(
-        g.irods_session.zone
-    ).get_template_for_catalog_item(
-        current_collection, "common/collection_view.html.j2"
-    )
     logging.info(f"Collection view: using template {view_template}")
     user_trash_path = f"/{g.irods_session.zone}/trash/home/{g.irods_session.username}"
 
-    return render_template(
+    rendered_view = render_view(
         view_template,
         co_path=co_path,
         breadcrumbs=generate_breadcrumbs(co_path),
         collection=current_collection,
         sub_collections=sub_collections,
         data_objects=data_objects,
+        listing=listing,
+        stream_listing_available=MANGO_STREAM_TEMPLATES,
         permissions=permissions,
         acl_users=acl_users,
         acl_users_dict=acl_users_dict,
@@ -428,10 +484,13 @@ def collection_browse(collection):
         my_groups=my_groups,
         metadata_objects=metadata_objects,
         current_user_rights=get_current_user_rights(
-            g.irods_session.username, current_collection
+            g.irods_session.username, current_collection, permissions
         ),
         user_trash_path=user_trash_path,
+        resumable_uploads=resumable_upload.MANGO_RESUMABLE_UPLOADS,
+        bulk_jobs=bulk_jobs.MANGO_BULK_JOBS,
     )
+    return with_etag(rendered_view, etag)
 
 
 @browse_bp.route("/data-object/view/<path:data_object_path>")
@@ -445,26 +504,55 @@ def view_object(data_object_path):
 
     # meta_data_items = data_object.metadata.items()
     # if MIME_TYPE_ATTRIBUTE_NAME not in [item.name for item in meta_data_items]:
+    mime_type = None
+    mime_type_pending = False
     if set(current_user_rights).intersection(set(["own", "write"])):
         try:
             mime_avu = data_object.metadata.get_one(MIME_TYPE_ATTRIBUTE_NAME)
+            mime_type = mime_avu.value
         except:
-            try:
-                with data_object.open("r") as f:
-                    blub = f.read(50 * 1024)  # read max 50k from data object
-                mime_type = magic.from_buffer(blub, mime=True)
-                mime_avu = iRODSMeta(MIME_TYPE_ATTRIBUTE_NAME, mime_type)
-                data_object.metadata.set(mime_avu)
-                # meta_data_items.append(mime_avu)
-                logging.info(
-                    f"mime-type was not set for object {data_object.path}, so we blubbed a bit into magic"
+            if MANGO_ASYNC_MIME_DETECTION:
+                # detected in the background, the page shows a placeholder meanwhile
+                queue_mime_detection(
+                    g.irods_session.zone, data_object.path, MIME_TYPE_ATTRIBUTE_NAME
                 )
+                mime_type_pending = True
+            else:
+                try:
+                    with data_object.open("r") as f:
+                        blub = f.read(50 * 1024)  # read max 50k from data object
+                    mime_type = magic.from_buffer(blub, mime=True)
+                    mime_avu = iRODSMeta(MIME_TYPE_ATTRIBUTE_NAME, mime_type)
+                    data_object.metadata.set(mime_avu)
+                    # meta_data_items.append(mime_avu)
+                    logging.info(
+                        f"mime-type was not set for object {data_object.path}, so we blubbed a bit into magic"
+                    )
 
-            except:
-                flash(
-                    f"An error occurred with reading from {data_object_path}, mime type missing but could not be determined",
-                    "warning",
-                )
+                except:
+                    flash(
+                        f"An error occurred with reading from {data_object_path}, mime type missing but could not be determined",
+                        "warning",
+                    )
+
+    view_template = get_template_override_manager(
+        g.irods_session.zone
+    ).get_template_for_catalog_item(data_object, "common/object_view.html.j2")
+    tika_storage = f"storage/{g.irods_session.zone}/tika_output"
+    tika_file_path = f"{tika_storage}/{data_object.id}.tika.json"
+    etag = view_etag(
+        lambda: [
+            data_object_fingerprint(g.irods_session, data_object_path),
+            (
+                os.path.getmtime(tika_file_path)
+                if os.path.exists(tika_file_path)
+                else None
+            ),
+        ],
+        view_template,
+    )
+    if is_not_modified(etag):
+        return not_modified(etag)
     ######################### new schema handling
     schemas = {}
     schema_manager = False
@@ -546,9 +634,7 @@ def view_object(data_object_path):
     # see if the mime type is present in the metadata, if not
     acl_users = []
 
-    permissions = g.irods_session.acls.get(
-        data_object, acl_users=acl_users
-    )
+    permissions = acl_cache.get_acls(g.irods_session, data_object, acl_users=acl_users)
 
     # Workaround for a bug with report_raw_acls for data objects where every ACL is listed twice
     PermissionTuple = namedtuple(
@@ -584,8 +670,6 @@ def view_object(data_object_path):
 
     # end temp
     tika_result = {}
-    tika_storage = f"storage/{g.irods_session.zone}/tika_output"
-    tika_file_path = f"{tika_storage}/{data_object.id}.tika.json"
 
     if os.path.exists(tika_file_path) and data_object.modify_time < (
         analysis_timestamp := datetime.datetime.fromtimestamp(
@@ -598,13 +682,10 @@ def view_object(data_object_path):
                 tzinfo=datetime.timezone.utc, microsecond=0
             ).isoformat()
 
-    view_template = get_template_override_manager(
-        g.irods_session.zone
-    ).get_template_for_catalog_item(data_object, "common/object_view.html.j2")
     logging.info(f"Object view: using template {view_template}")
     logging.info(f"Realm: {realm}")
 
-    return render_template(
+    rendered_view = render_template(
         view_template,
         data_object=data_object,
         meta_data_items=meta_data_items,
@@ -620,7 +701,10 @@ def view_object(data_object_path):
         tika_result=tika_result,
         consolidated_names=consolidated_analysis_metadata_names,
         current_user_rights=current_user_rights,
+        mime_type=mime_type,
+        mime_type_pending=mime_type_pending,
     )
+    return with_etag(rendered_view, etag)
 
 
 # @browse_bp.route("/data-object/download/<path:data_object_path>")
@@ -672,31 +756,9 @@ def download_object(data_object_path):
     if object_type is None:
         object_type = "application/octet-stream"
 
-    read_buffer_size = 2**24  # 16MiB
-    print(f"Current read buffer size is {read_buffer_size}")
-
-    def data_object_chunks():
-        with data_object.open("r") as f:
-            position = 0
-            start = time.time()
-            while position < data_object.size:
-                read_bytes = min(
-                    read_buffer_size,  # 64kB #g.irods_session.data_objects.READ_BUFFER_SIZE,  # typically 8MB
-                    data_object.size - position,
-                )
-                file_chunk = f.read(read_bytes)
-                bytes_read = len(file_chunk)
-                position += bytes_read
-                print(
-                    f"{data_object.name}: sending {position} bytes after {time.time()-start}"
-                )
-                yield file_chunk
-
-    return Response(
-        stream_with_context(data_object_chunks()),
-        mimetype=object_type,
-        direct_passthrough=True,
-        headers={"Content-Disposition": "attachment"},
+    # Range, If-Range and conditional requests, so downloads can resume or be segmented
+    return data_object_response(
+        data_object, object_type, headers={"Content-Disposition": "attachment"}
     )
 
 
@@ -803,8 +865,29 @@ def delete_data_object():
 
 
 @browse_bp.route("/collection/upload/file", methods=["POST"])
+# the csrf token is checked here, csrf protection would read the whole body up front
+@csrf.exempt
 def collection_upload_file():
     """ """
+    if upload.can_stream(request):
+        # straight into iRODS while the request body arrives
+        (form_fields, data_object_path) = upload.stream_upload(
+            g.irods_session, request
+        )
+        signals.data_object_added.send(
+            current_app._get_current_object(),
+            irods_session=g.irods_session,
+            data_object_path=data_object_path,
+        )
+        if "redirect_route" in form_fields:
+            return redirect(form_fields["redirect_route"])
+        if "redirect_hash" in form_fields:
+            return redirect(
+                request.referrer.split("#")[0] + form_fields["redirect_hash"]
+            )
+        return redirect(request.referrer)
+
+    csrf.protect()
     MANGO_STORAGE_BASE_PATH = Path("storage")
     TEMP_PATH = MANGO_STORAGE_BASE_PATH / "tmp"
     if not TEMP_PATH.exists():
@@ -841,6 +924,91 @@ def collection_upload_file():
     return redirect(request.referrer)
 
 
+def resumable_uploads_enabled():
+    if not resumable_upload.MANGO_RESUMABLE_UPLOADS:
+        abort(404)
+
+
+@browse_bp.route("/collection/upload/chunk", methods=["POST"])
+def collection_upload_chunk():
+    """Dropzone chunked upload, every file is a resumable upload with the dzuuid as id"""
+    resumable_uploads_enabled()
+    f = request.files["file"]
+    state = resumable_upload.get_or_create_upload(
+        g.irods_session,
+        request.form["dzuuid"],
+        request.form["collection"],
+        f.filename,
+        int(request.form["dztotalfilesize"]),
+    )
+    offset = int(request.form["dzchunkbyteoffset"])
+    length = min(int(request.form["dzchunksize"]), state["size"] - offset)
+    state = resumable_upload.write_chunk(
+        g.irods_session, state["id"], offset, length, f.stream
+    )
+    return flask.jsonify(resumable_upload.progress(state))
+
+
+@browse_bp.route("/api/upload/resumable", methods=["POST"])
+def create_resumable_upload():
+    """Starts a resumable upload of the file name with the size into the collection"""
+    resumable_uploads_enabled()
+    values = request.get_json(silent=True) or request.values
+    try:
+        size = int(values["size"])
+        (collection, filename) = (values["collection"], values["filename"])
+    except (KeyError, ValueError):
+        abort(400, "collection, filename and size are required")
+    if not g.irods_session.collections.exists(collection):
+        abort(404, "Path not found or not accessible for you")
+    state = resumable_upload.create_upload(g.irods_session, collection, filename, size)
+    response = flask.jsonify(resumable_upload.progress(state))
+    response.status_code = 201
+    response.headers["Location"] = url_for(
+        "browse_bp.resumable_upload_chunk", upload_id=state["id"]
+    )
+    return response
+
+
+@browse_bp.route(
+    "/api/upload/resumable/<upload_id>", methods=["GET", "PATCH", "DELETE"]
+)
+def resumable_upload_chunk(upload_id):
+    """Progress (GET), a chunk at the Upload-Offset header (PATCH) or abort (DELETE)"""
+    resumable_uploads_enabled()
+    if request.method == "DELETE":
+        resumable_upload.abort_upload(g.irods_session, upload_id)
+        return Response(status=204)
+    if request.method == "PATCH":
+        try:
+            offset = int(request.headers.get("Upload-Offset", request.args["offset"]))
+        except (KeyError, ValueError):
+            abort(400, "Upload-Offset header or offset argument required")
+        state = resumable_upload.write_chunk(
+            g.irods_session,
+            upload_id,
+            offset,
+            request.content_length,
+            request.stream,
+            request.headers.get("Upload-Checksum", None),
+        )
+    else:
+        state = resumable_upload.get_upload(g.irods_session, upload_id)
+    return flask.jsonify(resumable_upload.progress(state))
+
+
+@browse_bp.route("/api/upload/resumable/<upload_id>/finalize", methods=["POST"])
+def finalize_resumable_upload(upload_id):
+    resumable_uploads_enabled()
+    data_object_path = resumable_upload.finalize_upload(g.irods_session, upload_id)
+    signals.data_object_added.send(
+        current_app._get_current_object(),
+        irods_session=g.irods_session,
+        data_object_path=data_object_path,
+    )
+    return flask.jsonify({"path": data_object_path})
+
+
 @browse_bp.route("/collection/add/subcollection", methods=["POST"])
 def add_collection():
     """ """
@@ -1110,12 +1278,14 @@ def set_inheritance(collection_path: str):
 @browse_bp.route("/trash/empty/user", methods=["POST"])
 def empty_user_trash():
     user_trash_path = f"/{g.irods_session.zone}/trash/home/{g.irods_session.username}"
-    user_trash = g.irods_session.collections.get(user_trash_path)
+    sub_collections, data_objects = list_collection_contents(
+        g.irods_session, user_trash_path
+    )
 
-    for sub_collection in user_trash.subcollections:
+    for sub_collection in sub_collections:
         g.irods_session.collections.remove(sub_collection.path, force=True)
-    for data_object in user_trash.data_objects:
-        g.irods_session.data_objects.get(data_object.path).unlink(force=True)
+    for data_object in data_objects:
+        g.irods_session.data_objects.unlink(data_object.path, force=True)
 
     flash(f"Emptied your trash can", "success")
 
@@ -1133,8 +1303,7 @@ def empty_user_trash():
 def bulk_operation_items():
     """ """
 
-    def return_error(message):
-        flash(message, category="warning")
+    def return_redirect():
         if "redirect_route" in request.values:
             return redirect(request.values["redirect_route"])
         if "redirect_hash" in request.values:
@@ -1143,6 +1312,10 @@ def bulk_operation_items():
             )
         return redirect(request.referrer)
 
+    def return_error(message):
+        flash(message, category="warning")
+        return return_redirect()
+
     if not ("items" in request.form):
         return return_error("Missing selection")
     if not ("action" in request.form):
@@ -1150,7 +1323,7 @@ def bulk_operation_items():
     if (request.form["action"] in ["move", "copy"]) and not (
         "destination" in request.form
     ):
-        return_error("Destination for move or copy is missing")
+        return return_error("Destination for move or copy is missing")
 
     irods_session: iRODSSession = g.irods_session
     irods_session.collections
@@ -1163,217 +1336,141 @@ def bulk_operation_items():
 
     action = request.form["action"]
 
-    if action == "delete":
-        force_delete = (
-            True
-            if "force_delete" in request.form and request.form["force_delete"]
-            else False
+    if action in bulk_jobs.ACTIONS:
+        job = bulk_jobs.new_job(
+            irods_session,
+            action,
+            bulk_jobs.parse_items(request.form.getlist("items")),
+            destination=request.form.get("destination", None),
+            force_delete=bool(request.form.get("force_delete", False)),
         )
-        for item in request.form.getlist("items"):
-            match = re.match(r"(dobj|col)-(.*)", item)
-            if match:
-                (item_type, item_path) = (match.group(1), match.group(2))
-                if item_type == ITEM_TYPE_PART["data_object"]:
-                    try:
-                        irods_session.data_objects.get(item_path).unlink(
-                            force=force_delete
-                        )
-
-                        if force_delete:
-                            signals.data_object_deleted.send(
-                                current_app._get_current_object(),
-                                irods_session=g.irods_session,
-                                data_object_path=item_path,
-                            )
-                        else:
-                            signals.data_object_trashed.send(
-                                current_app._get_current_object(),
-                                irods_session=g.irods_session,
-                                data_object_path=item_path,
-                            )
-                        success_count += 1
-                    except Exception as e:
-                        success = False
-                        failure_count += 1
-                        flash(
-                            f"Problem removing data object {item_path} : {e}", "danger"
-                        )
-                if item_type == ITEM_TYPE_PART["collection"]:
-                    try:
-                        irods_session.collections.remove(item_path, force=force_delete)
-                        if force_delete:
-                            signals.collection_deleted.send(
-                                current_app._get_current_object(),
-                                irods_session=g.irods_session,
-                                collection_path=item_path,
-                            )
-                        else:
-                            signals.collection_trashed.send(
-                                current_app._get_current_object(),
-                                irods_session=g.irods_session,
-                                collection_path=item_path,
-                            )
-                        success_count += 1
-                    except Exception as e:
-                        success = False
-                        failure_count += 1
-                        flash(
-                            f"Problem removing data object {item_path} : {e}", "danger"
-                        )
-
-    def get_safe_path_if_data_object_exists(path_to_check: PurePath):
-        if irods_session.data_objects.exists(path_to_check.as_posix()):
-            alternate_path = path_to_check.parent / (
-                path_to_check.stem + "-copy" + path_to_check.suffix
-            )
-            logging.info(
-                f"{path_to_check} already exists, renaming to {alternate_path}"
-            )
+        if bulk_jobs.MANGO_BULK_JOBS:
+            # the browser polls the job status
+            bulk_jobs.submit_job(current_app._get_current_object(), irods_session, job)
+            if request.accept_mimetypes.best == "application/json":
+                response = flask.jsonify(bulk_jobs.public_job(job, with_items=False))
+                response.status_code = 202
+                response.headers["Location"] = url_for(
+                    "browse_bp.bulk_job_status", job_id=job["id"]
+                )
+                return response
             flash(
-                f"{path_to_check} already exists, renaming to {alternate_path}",
-                "warning",
+                f"Started to {action} {len(job['items'])} items in the background",
+                "info",
             )
-            return get_safe_path_if_data_object_exists(alternate_path)
-        # logging.info(f"get safe path: {path_to_check} does not exist yet")
-        return path_to_check
-
-    if action == "move":
-        for item in request.form.getlist("items"):
-            match = re.match(r"(dobj|col)-(.*)", item)
-            if match:
-                (item_type, item_path) = (match.group(1), match.group(2))
-                new_path = (
-                    PurePath(request.form["destination"]) / PurePath(item_path).name
+            return return_redirect()
+        bulk_jobs.run_job(current_app._get_current_object(), irods_session, job)
+        for item in job["items"]:
+            if item["message"]:
+                flash(
+                    item["message"], "danger" if item["status"] == "failed" else "warning"
                 )
-                if new_path.as_posix() == item_path:
-                    flash(
-                        f"Source {item_path} is equal to destination {new_path}, not moving",
-                        "warning",
-                    )
-                    success = False
-                    failure_count += 1
-                    break
-                if item_type == ITEM_TYPE_PART["data_object"]:
-                    try:
-                        safe_path = get_safe_path_if_data_object_exists(new_path)
-                        safe_path_as_string = safe_path.as_posix()
-                        # logging.info(f"Moving {item_path} to {safe_path_as_string}")
-                        irods_session.data_objects.move(item_path, safe_path_as_string)
-                        signals.data_object_moved.send(
-                            current_app._get_current_object(),
-                            irods_session=g.irods_session,
-                            original_path=item_path,
-                            destination_path=safe_path_as_string,
-                            new_path=new_path,
-                        )
-                        success_count += 1
-                    except Exception as e:
-                        success = False
-                        failure_count += 1
-                        flash(f"Problem moving data object {item_path} : {e}", "danger")
+        job_counts = bulk_jobs.counts(job)
+        success_count = job_counts["succeeded"]
+        failure_count = job_counts["failed"]
+        success = failure_count == 0
 
-                if item_type == ITEM_TYPE_PART["collection"]:
-                    try:
-                        irods_session.collections.move(
-                            item_path, request.form["destination"]
-                        )
-                        signals.collection_moved.send(
-                            current_app._get_current_object(),
-                            irods_session=g.irods_session,
-                            original_path=item_path,
-                            destination_path=request.form["destination"],
-                            new_path=new_path,
-                        )
-                        success_count += 1
-                    except Exception as e:
-                        success = False
-                        failure_count += 1
-                        flash(f"Problem moving collection {item_path} : {e}", "danger")
+    if action == "download":
+        # type, size and existence of every selected item, in one batch of GenQueries
+        resolved_items = resolve_paths(
+            irods_session,
+            [
+                match.group(2)
+                for item in request.form.getlist("items")
+                if (match := re.match(r"(dobj|col)-(.*)", item))
+            ],
+        )
 
-    if action == "copy":
-        for item in request.form.getlist("items"):
-            match = re.match(r"(dobj|col)-(.*)", item)
-            if match:
-                (item_type, item_path) = (match.group(1), match.group(2))
-                new_path = (
-                    PurePath(request.form["destination"]) / PurePath(item_path).name
-                )
-                if item_type == ITEM_TYPE_PART["data_object"]:
-                    try:
-                        safe_path = get_safe_path_if_data_object_exists(new_path)
-                        safe_path_as_string = safe_path.as_posix()
-                        # logging.info(f"Copying {item_path} to {safe_path_as_string}")
-                        irods_session.data_objects.copy(item_path, safe_path_as_string)
-                        signals.data_object_copied.send(
-                            current_app._get_current_object(),
-                            irods_session=g.irods_session,
-                            data_object_path=item_path,
-                            destination_path=safe_path_as_string,
-                            new_path=safe_path_as_string,
-                        )
-                        success_count += 1
-                    except Exception as e:
-                        success = False
-                        failure_count += 1
-                        flash(f"Problem copying {item_path} : {e}", "danger")
+        def is_missing(item_path):
+            nonlocal success, failure_count
+            if item_path.rstrip("/") in resolved_items:
+                return False
+            success = False
+            failure_count += 1
+            flash(f"{item_path} does not exist or is not accessible for you", "danger")
+            return True
 
-    if action == "download":
         # @todo move and read from global config
-        MANGO_STORAGE_BASE_PATH = Path("storage")
         MAX_BD_ITEM_SIZE = 20 * 1024 * 1024 * 1024
         MAX_TOTAL_ARCHIVE_SIZE = 50 * 1024 * 1024 * 1024
 
         bulk_action_id = (
             f"{irods_session.zone}-{irods_session.username}-{int(time.time())}"
         )
-
-        temp_archive_dir = MANGO_STORAGE_BASE_PATH / "tmp_bulk" / bulk_action_id
-        temp_archive_dir.mkdir(parents=True, exist_ok=True)
-
-        total_size = 0
+        archive_format = request.form.get("archive_format", "tar")
+        if archive_format not in ARCHIVE_FORMATS:
+            abort(400, f"Unsupported archive format {archive_format}")
+
+        # the archive is generated while it is sent, entries read straight from iRODS
+        archive_entries = []
+
+        def add_archive_entry(resolved_item, name):
+            """Adds the data object unless it is larger than MAX_BD_ITEM_SIZE"""
+            nonlocal success, failure_count
+            if resolved_item.size >= MAX_BD_ITEM_SIZE:
+                success = False
+                failure_count += 1
+                flash(
+                    f"{resolved_item.path} is larger than {MAX_BD_ITEM_SIZE}, not added to the archive",
+                    "warning",
+                )
+                return False
+            archive_entries.append(
+                ArchiveEntry(
+                    f"{bulk_action_id}/{name}",
+                    resolved_item.size,
+                    resolved_item.modify_time,
+                    partial(data_object_chunks, irods_session, resolved_item.path),
+                )
+            )
+            return True
 
         for item in request.form.getlist("items"):
             match = re.match(r"(dobj|col)-(.*)", item)
             if match:
                 (item_type, item_path) = (match.group(1), match.group(2))
+                if is_missing(item_path):
+                    continue
+                item_path = item_path.rstrip("/")
                 if item_type == ITEM_TYPE_PART["data_object"]:
-                    try:
-                        data_object: iRODSDataObject = irods_session.data_objects.get(
-                            item_path
+                    if add_archive_entry(
+                        resolved_items[item_path], PurePath(item_path).name
+                    ):
+                        success_count += 1
+                if item_type == ITEM_TYPE_PART["collection"]:
+                    # the complete subtree in one query, kept below the collection name
+                    collection_name = PurePath(item_path).name
+                    added = [
+                        add_archive_entry(
+                            resolved_item,
+                            f"{collection_name}{resolved_item.path[len(item_path):]}",
                         )
-                        if data_object.size < MAX_BD_ITEM_SIZE:
-                            save_path: Path = temp_archive_dir / data_object.name
-                            irods_session.data_objects.get(
-                                item_path, save_path.as_posix()
-                            )
-                        total_size += data_object.size
+                        for resolved_item in resolve_subtree_data_objects(
+                            irods_session, item_path
+                        )
+                    ]
+                    if any(added):
                         success_count += 1
-                    except Exception as e:
-                        success = False
-                        failure_count += 1
-                        flash(f"Problem copying {item_path} : {e}", "danger")
-            if total_size > MAX_TOTAL_ARCHIVE_SIZE:
-                flash(
-                    f"Maximum size reached {total_size} > {MAX_TOTAL_ARCHIVE_SIZE}, stopped adding files to the archive",
-                    "danger",
-                )
-                break
-        bd_tar_filename = temp_archive_dir.as_posix() + ".tar"
-        bd_tar_file = tarfile.TarFile(bd_tar_filename, "w")
-        bd_tar_file.add(temp_archive_dir.as_posix(), arcname=bulk_action_id)
-        bd_tar_file.close()
-
-        rm_pathlib_tree(temp_archive_dir)
+                    elif not added:
+                        flash(
+                            f"{item_path} contains no data objects, nothing to download",
+                            "warning",
+                        )
 
-        return Response(
-            stream_with_context(
-                read_file_in_chunks(bd_tar_filename, delete_after=True)
-            ),
-            direct_passthrough=True,
-            headers={
-                "Content-Disposition": f"attachment; filename={bulk_action_id}.tar"
-            },
-        )
+        total_size = sum(entry.size for entry in archive_entries)
+        if not archive_entries:
+            success = False
+        elif total_size > MAX_TOTAL_ARCHIVE_SIZE:
+            success = False
+            failure_count += 1
+            flash(
+                f"The selection is too large to download as an archive ({total_size} > {MAX_TOTAL_ARCHIVE_SIZE} bytes)",
+                "danger",
+            )
+        else:
+            return archive_response(
+                archive_entries, bulk_action_id, archive_format, manifest=True
+            )
 
     OPERATION_SUCCESS_STRINGS = {
         "delete": "deleted",
@@ -1403,6 +1500,31 @@ def bulk_operation_items():
     return redirect(request.referrer)
 
 
+@browse_bp.route("/api/bulk/jobs")
+def bulk_jobs_list():
+    return flask.jsonify(
+        [
+            bulk_jobs.public_job(job, with_items=False)
+            for job in bulk_jobs.list_jobs(g.irods_session)
+        ]
+    )
+
+
+@browse_bp.route("/api/bulk/jobs/<job_id>")
+def bulk_job_status(job_id):
+    """Progress and status of the job, items=0 leaves out the per item results"""
+    job = bulk_jobs.get_job(g.irods_session, job_id)
+    return flask.jsonify(
+        bulk_jobs.public_job(job, with_items=request.args.get("items", "1") != "0")
+    )
+
+
+@browse_bp.route("/api/bulk/jobs/<job_id>/cancel", methods=["POST"])
+def bulk_job_cancel(job_id):
+    job = bulk_jobs.cancel_job(g.irods_session, job_id)
+    return flask.jsonify(bulk_jobs.public_job(job, with_items=False))
+
+
 @browse_bp.route("/item/rename", methods=["POST"])
 def rename_item():
     if "item_path" not in request.form or "new_name" not in request.form:
@@ -1421,7 +1543,8 @@ def rename_item():
     if item_path == new_path:
         flash("The name has not changed", "danger")
     else:
-        if irods_session.collections.exists(item_path):
+        item_type = get_type_for_path(irods_session, item_path, default=None)
+        if item_type == "collection":
             irods_session.collections.move(item_path, new_path)
             signals.collection_renamed.send(
                 current_app._get_current_object(),
@@ -1432,7 +1555,7 @@ def rename_item():
             redirect_route = url_for("browse_bp.collection_browse", collection=new_path)
             flash("Renamed collection successfully", "success")
 
-        elif irods_session.data_objects.exists(item_path):
+        elif item_type == "data_object":
             irods_session.data_objects.move(item_path, new_path)
             signals.data_object_renamed.send(
                 current_app._get_current_object(),
@@ -1443,11 +1566,40 @@ def rename_item():
             redirect_route = url_for("browse_bp.view_object", data_object_path=new_path)
             flash("Renamed data object successfully", "success")
         else:
-            flash("{item_path} does not exist", "danger")
+            flash(f"{item_path} does not exist", "danger")
 
     return redirect(redirect_route)
 
 
+@browse_bp.route("/api/collection/listing/<path:collection>")
+def get_collection_listing(collection):
+    """One page of the collection listing as json, same arguments as the collection view
+
+    page, page_size, sort (name, size or modify_time) and order (asc or desc)
+    """
+    if not collection.startswith("/"):
+        collection = "/" + collection
+    if not g.irods_session.collections.exists(collection):
+        abort(404, "Path not found or not accessible for you")
+    listing = listing_cache.get_collection_page(
+        g.irods_session, collection, *parse_listing_args(request.args)
+    )
+    return flask.jsonify(
+        {
+            "path": collection,
+            "page": listing.page,
+            "page_size": listing.page_size,
+            "sort": listing.sort,
+            "order": listing.order,
+            "has_more": listing.has_more,
+            "sub_collections": [
+                listing_row_to_dict(row) for row in listing.sub_collections
+            ],
+            "data_objects": [listing_row_to_dict(row) for row in listing.data_objects],
+        }
+    )
+
+
 @browse_bp.route(
     "/api/collection/subcollections",
     methods=["GET"],
@@ -1456,14 +1608,28 @@ def rename_item():
 )
 @browse_bp.route("/api/collection/subcollections/<path:collection>")
 def get_sub_collections(collection):
+    """Sub collections as {path, name, children}, nested depth levels deep (default 1)
+
+    With format=treeselect the nodes are {id, label, children} for vue-treeselect
+    """
     if collection is None or collection == "~":
         collection = g.zone_home
     if not collection.startswith("/"):
         collection = "/" + collection
-    current_collection = g.irods_session.collections.get(collection)
-    d = {"path": current_collection.path, "name": current_collection.name}
-    d["children"] = [
-        {"path": collection.path, "name": collection.name}
-        for collection in current_collection.subcollections
-    ]
-    return flask.jsonify(d)
+    collection = collection.rstrip("/") or "/"
+    if not g.irods_session.collections.exists(collection):
+        abort(404, "Path not found or not accessible for you")
+    depth = request.args.get("depth", 1, type=int)
+    if depth > 1:
+        d = listing_cache.get_collection_tree(g.irods_session, collection, depth)
+    else:
+        d = {"path": collection, "name": collection.rsplit("/", 1)[-1]}
+        d["children"] = [
+            {"path": sub_collection.path, "name": sub_collection.name}
+            for sub_collection in listing_cache.get_sub_collections(
+                g.irods_session, collection
+            )
+        ]
+    if request.args.get("format", "") == "treeselect":
+        d = tree_to_treeselect(d)
+    return gzip_response(flask.jsonify(d))
@@ -0,0 +1,412 @@
+# Bulk move, copy and delete as background jobs
+#
+# A bulk action on thousands of items takes minutes, too long for a request. The action is
+# submitted as a job and runs on a pool of MANGO_BULK_JOB_WORKERS threads with its own
+# clone of the iRODS session of the user, the browser polls the job status instead. Every
+# item gets a result (done, failed, skipped or cancelled, with a message), a job can be
+# cancelled between items.
+#
+# Jobs are json files in storage/bulk_jobs, saved at least every SAVE_INTERVAL seconds
+# while running, so status and results survive restarts and are visible to every worker
+# process. As a single item can take minutes, a heartbeat touches the file of a queued or
+# running job every HEARTBEAT_INTERVAL seconds, independent of the items. A job runs in the process it was submitted to, a job of a process that is gone
+# shows as interrupted with its remaining items unprocessed, jobs are never resumed with
+# other credentials. Finished jobs are removed after MANGO_BULK_JOB_TTL seconds.
+#
+# Opt-in via MANGO_BULK_JOBS=enabled, otherwise the job runs within the request.
+
+import os
+import re
+import json
+import time
+import uuid
+import logging
+from pathlib import Path, PurePath
+from threading import Event, Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import abort
+from irods.query import Query
+from irods.models import Collection, DataObject
+
+import signals
+import irods_session_pool
+from lib.util import resolve_paths
+
+MANGO_BULK_JOBS = os.environ.get("MANGO_BULK_JOBS", "disabled").lower() == "enabled"
+MANGO_BULK_JOB_WORKERS = int(os.environ.get("MANGO_BULK_JOB_WORKERS", 2))
+MANGO_BULK_JOB_TTL = int(os.environ.get("MANGO_BULK_JOB_TTL", 7 * 24 * 60 * 60))
+JOBS_PATH = Path("storage") / "bulk_jobs"
+SAVE_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 10
+# a running job without save or heartbeat for this long belongs to a process that is gone
+STALE_AFTER = 60
+
+ACTIONS = ("delete", "move", "copy")
+ITEM_TYPE_PART = {"data_object": "dobj", "collection": "col"}
+FINISHED = ("completed", "failed", "cancelled", "interrupted")
+
+# the jobs of this process by id, with their cancel events, the items of a running job
+# are only changed by its worker
+jobs = {}
+cancel_events = {}
+jobs_lock = Lock()
+job_executor = ThreadPoolExecutor(
+    max_workers=MANGO_BULK_JOB_WORKERS, thread_name_prefix="mango-bulk"
+)
+
+
+def job_file(job_id):
+    return JOBS_PATH / f"{job_id}.json"
+
+
+def save_job(job):
+    job["updated"] = time.time()
+    JOBS_PATH.mkdir(parents=True, exist_ok=True)
+    temp_file = job_file(job["id"]).with_suffix(".tmp")
+    temp_file.write_text(json.dumps(job))
+    # atomic, readers never see a partially written job
+    temp_file.replace(job_file(job["id"]))
+
+
+def heartbeat(job_id, finished: Event):
+    """Touches the job file every HEARTBEAT_INTERVAL seconds until finished is set"""
+    while not finished.wait(HEARTBEAT_INTERVAL):
+        now = time.time()
+        try:
+            os.utime(job_file(job_id), (now, now))
+        except OSError as e:
+            logging.warning(f"Heartbeat of bulk job {job_id} failed: {e}")
+
+
+def parse_items(form_items):
+    """The job items for the dobj-<path> and col-<path> values of the bulk form"""
+    items = []
+    for item in form_items:
+        if match := re.match(r"(dobj|col)-(.*)", item):
+            items.append(
+                {
+                    "item": item,
+                    "type": match.group(1),
+                    "path": match.group(2),
+                    "status": "pending",
+                    "message": None,
+                    "destination": None,
+                }
+            )
+    return items
+
+
+def new_job(irods_session, action, items, destination=None, force_delete=False):
+    if action not in ACTIONS:
+        abort(400, f"Unsupported bulk action {action}")
+    return {
+        "id": str(uuid.uuid4()),
+        "zone": irods_session.zone,
+        "username": irods_session.username,
+        "action": action,
+        "destination": destination,
+        "force_delete": force_delete,
+        "status": "queued",
+        "created": time.time(),
+        "started": None,
+        "finished": None,
+        "items": items,
+    }
+
+
+def counts(job):
+    statuses = [item["status"] for item in job["items"]]
+    return {
+        "total": len(statuses),
+        "processed": sum(1 for status in statuses if status != "pending"),
+        "succeeded": statuses.count("done"),
+        "failed": statuses.count("failed"),
+        "skipped": statuses.count("skipped") + statuses.count("cancelled"),
+    }
+
+
+def public_job(job, with_items=True):
+    """The status of a job as served by the API"""
+    public = {
+        key: job[key]
+        for key in [
+            "id",
+            "action",
+            "destination",
+            "status",
+            "created",
+            "started",
+            "finished",
+        ]
+    }
+    public.update(counts(job))
+    if with_items:
+        public["items"] = [
+            {key: item[key] for key in ["path", "status", "message", "destination"]}
+            for item in job["items"]
+        ]
+    return public
+
+
+def load_job(job_id):
+    if (job := jobs.get(job_id, None)) is not None:
+        return job
+    try:
+        job = json.loads(job_file(job_id).read_text())
+        # the heartbeat only updates the modification time
+        updated = max(job["updated"], job_file(job_id).stat().st_mtime)
+    except (ValueError, OSError):
+        return None
+    if job["status"] not in FINISHED and time.time() - updated > STALE_AFTER:
+        job["status"] = "interrupted"
+    return job
+
+
+def owned_by(job, irods_session):
+    return (job["zone"], job["username"]) == (
+        irods_session.zone,
+        irods_session.username,
+    )
+
+
+def get_job(irods_session, job_id) -> dict:
+    """The job, 404 if it does not exist or belongs to someone else"""
+    try:
+        job_id = str(uuid.UUID(job_id))
+    except ValueError:
+        abort(404, "Job not found")
+    if (job := load_job(job_id)) is None or not owned_by(job, irods_session):
+        abort(404, "Job not found")
+    return job
+
+
+def list_jobs(irods_session) -> list:
+    """The jobs of the user, most recent first, expired ones are removed"""
+    user_jobs = []
+    for path in JOBS_PATH.glob("*.json") if JOBS_PATH.exists() else []:
+        if (job := load_job(path.stem)) is None or not owned_by(job, irods_session):
+            continue
+        if (
+            job["status"] in FINISHED
+            and time.time() - job["updated"] > MANGO_BULK_JOB_TTL
+        ):
+            path.unlink(missing_ok=True)
+            continue
+        user_jobs.append(job)
+    return sorted(user_jobs, key=lambda job: job["created"], reverse=True)
+
+
+def cancel_job(irods_session, job_id) -> dict:
+    job = get_job(irods_session, job_id)
+    if job["status"] in FINISHED:
+        return job
+    if job["id"] not in cancel_events:
+        abort(409, "The job runs in another process")
+    cancel_events[job["id"]].set()
+    return job
+
+
+class DestinationNames:
+    """Collision free data object names in the destination collection of a job
+
+    The names in the collection are fetched with one GenQuery, the names handed out are
+    reserved in memory, so a whole batch of items takes no further catalog queries
+    """
+
+    def __init__(self, irods_session, collection_path):
+        self.taken = set(
+            row[DataObject.name]
+            for row in Query(irods_session, DataObject.name).filter(
+                Collection.name == collection_path.rstrip("/")
+            )
+        )
+
+    def safe_path(self, new_path: PurePath) -> PurePath:
+        """new_path, or with -copy added to the stem until the name is free"""
+        safe_path = new_path
+        while safe_path.name in self.taken:
+            safe_path = safe_path.parent / (safe_path.stem + "-copy" + safe_path.suffix)
+        if safe_path != new_path:
+            logging.info(f"{new_path} already exists, renaming to {safe_path}")
+        self.taken.add(safe_path.name)
+        return safe_path
+
+
+def delete_item(app, irods_session, job, item, destination_names):
+    force_delete = job["force_delete"]
+    if item["type"] == ITEM_TYPE_PART["data_object"]:
+        irods_session.data_objects.unlink(item["path"], force=force_delete)
+        signal = (
+            signals.data_object_deleted if force_delete else signals.data_object_trashed
+        )
+        signal.send(app, irods_session=irods_session, data_object_path=item["path"])
+    else:
+        irods_session.collections.remove(item["path"], force=force_delete)
+        signal = (
+            signals.collection_deleted if force_delete else signals.collection_trashed
+        )
+        signal.send(app, irods_session=irods_session, collection_path=item["path"])
+
+
+def move_item(app, irods_session, job, item, destination_names):
+    new_path = PurePath(job["destination"]) / PurePath(item["path"]).name
+    if item["type"] == ITEM_TYPE_PART["data_object"]:
+        safe_path = destination_names.safe_path(new_path)
+        irods_session.data_objects.move(item["path"], safe_path.as_posix())
+        item["destination"] = safe_path.as_posix()
+        signals.data_object_moved.send(
+            app,
+            irods_session=irods_session,
+            original_path=item["path"],
+            destination_path=safe_path.as_posix(),
+            new_path=safe_path.as_posix(),
+        )
+    else:
+        irods_session.collections.move(item["path"], job["destination"])
+        item["destination"] = new_path.as_posix()
+        signals.collection_moved.send(
+            app,
+            irods_session=irods_session,
+            original_path=item["path"],
+            destination_path=job["destination"],
+            new_path=new_path.as_posix(),
+        )
+    if item["destination"] != new_path.as_posix():
+        item["message"] = f"{new_path} already exists, renamed to {item['destination']}"
+
+
+def copy_item(app, irods_session, job, item, destination_names):
+    if item["type"] != ITEM_TYPE_PART["data_object"]:
+        item["status"] = "skipped"
+        item["message"] = f"Copying collections is not supported, {item['path']}"
+        return
+    new_path = PurePath(job["destination"]) / PurePath(item["path"]).name
+    safe_path = destination_names.safe_path(new_path)
+    irods_session.data_objects.copy(item["path"], safe_path.as_posix())
+    item["destination"] = safe_path.as_posix()
+    signals.data_object_copied.send(
+        app,
+        irods_session=irods_session,
+        data_object_path=item["path"],
+        destination_path=safe_path.as_posix(),
+        new_path=safe_path.as_posix(),
+    )
+    if safe_path != new_path:
+        item["message"] = f"{new_path} already exists, renamed to {safe_path}"
+
+
+ITEM_OPERATIONS = {"delete": delete_item, "move": move_item, "copy": copy_item}
+ITEM_OPERATION_STRINGS = {"delete": "removing", "move": "moving", "copy": "copying"}
+
+
+def run_job(app, irods_session, job, cancelled=None, save=False):
+    """Processes the items of the job in order, the results are kept in the items
+
+    With save, the job is saved at least every SAVE_INTERVAL seconds
+    """
+    job["status"] = "running"
+    job["started"] = time.time()
+    last_saved = 0
+    try:
+        # type and existence of every item, in one batch of GenQueries
+        resolved_items = resolve_paths(
+            irods_session, [item["path"] for item in job["items"]]
+        )
+        # names already taken in the destination, in one GenQuery
+        destination_names = (
+            DestinationNames(irods_session, job["destination"])
+            if job["action"] in ("move", "copy")
+            else None
+        )
+        for item in job["items"]:
+            if cancelled is not None and cancelled.is_set():
+                item["status"] = "cancelled"
+                continue
+            if job["status"] == "failed":
+                item["status"] = "skipped"
+                continue
+            if item["path"].rstrip("/") not in resolved_items:
+                item["status"] = "failed"
+                item["message"] = (
+                    f"{item['path']} does not exist or is not accessible for you"
+                )
+                continue
+            if job["action"] == "move" and (
+                PurePath(job["destination"]) / PurePath(item["path"]).name
+            ) == PurePath(item["path"]):
+                # the other items are most likely in the same place, stop here
+                item["status"] = "failed"
+                item["message"] = (
+                    f"Source {item['path']} is equal to the destination, not moving"
+                )
+                job["status"] = "failed"
+                continue
+            try:
+                ITEM_OPERATIONS[job["action"]](
+                    app, irods_session, job, item, destination_names
+                )
+                if item["status"] == "pending":
+                    item["status"] = "done"
+            except Exception as e:
+                item["status"] = "failed"
+                item["message"] = (
+                    f"Problem {ITEM_OPERATION_STRINGS[job['action']]} {item['path']} : {e}"
+                )
+            if save and time.time() - last_saved >= SAVE_INTERVAL:
+                save_job(job)
+                last_saved = time.time()
+        if job["status"] == "running":
+            job["status"] = (
+                "cancelled"
+                if cancelled is not None and cancelled.is_set()
+                else "completed"
+            )
+    except Exception as e:
+        logging.warning(f"Bulk job {job['id']} failed: {e}")
+        job["status"] = "failed"
+        for item in job["items"]:
+            if item["status"] == "pending":
+                item["status"] = "skipped"
+    finally:
+        job["finished"] = time.time()
+        if save:
+            save_job(job)
+    return job
+
+
+def run_job_in_background(app, irods_session, job, finished: Event):
+    try:
+        with app.app_context():
+            run_job(app, irods_session, job, cancel_events[job["id"]], save=True)
+        logging.info(f"Bulk job {job['id']} {job['status']}: {counts(job)}")
+    finally:
+        finished.set()
+        irods_session.cleanup()
+        with jobs_lock:
+            jobs.pop(job["id"], None)
+            cancel_events.pop(job["id"], None)
+
+
+def submit_job(app, irods_session, job) -> dict:
+    """Queues the job, it runs with a clone of irods_session"""
+    save_job(job)
+    with jobs_lock:
+        jobs[job["id"]] = job
+        cancel_events[job["id"]] = Event()
+    # also while queued, the job waits for a free worker
+    finished = Event()
+    Thread(
+        target=heartbeat,
+        args=(job["id"], finished),
+        daemon=True,
+        name=f"mango-bulk-heartbeat-{job['id']}",
+    ).start()
+    job_executor.submit(
+        run_job_in_background,
+        app,
+        irods_session_pool.clone_session(irods_session),
+        job,
+        finished,
+    )
+    return job
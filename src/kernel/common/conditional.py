@@ -0,0 +1,150 @@
+# Conditional GET for the collection and data object views
+#
+# The ETag of a view combines the request (path and arguments), the user, the selected
+# template and a fingerprint of the catalog item: its modify time, its ACLs, and the
+# number and a digest of the ids, names and modify times of its AVUs and (for
+# collections) its children. These come from a handful of GenQueries on a few columns,
+# much cheaper than the view itself, so an unchanged page answers 304 Not Modified. Parts of the page that live outside the
+# catalog (schemas, group memberships, ...) are covered by rolling the ETag over every
+# MANGO_VIEW_ETAG_TTL seconds. Opt-in via MANGO_VIEW_ETAGS=enabled
+
+import os
+import time
+import json
+import hashlib
+
+from flask import g, request, session, make_response, Response
+from irods.query import Query
+from irods.models import (
+    Collection,
+    CollectionAccess,
+    CollectionMeta,
+    DataObject,
+    DataAccess,
+    DataObjectMeta,
+)
+
+MANGO_VIEW_ETAGS = os.environ.get("MANGO_VIEW_ETAGS", "disabled").lower() == "enabled"
+MANGO_VIEW_ETAG_TTL = int(os.environ.get("MANGO_VIEW_ETAG_TTL", 300))
+
+
+def sorted_rows(query, *columns):
+    return sorted(tuple(str(row[column]) for column in columns) for row in query)
+
+
+def digest(query, *columns):
+    """Number and sha1 of the rows matched by query, over the given columns
+
+    Any added, removed, renamed or modified row changes it, unlike an id sum
+    """
+    rows = sorted_rows(query, *columns)
+    return [len(rows), hashlib.sha1(json.dumps(rows).encode()).hexdigest()]
+
+
+def collection_fingerprint(irods_session, collection_path):
+    return [
+        sorted_rows(
+            Query(
+                irods_session,
+                Collection.modify_time,
+                Collection.inheritance,
+                CollectionAccess.user_id,
+                CollectionAccess.name,
+            ).filter(Collection.name == collection_path),
+            Collection.modify_time,
+            Collection.inheritance,
+            CollectionAccess.user_id,
+            CollectionAccess.name,
+        ),
+        digest(
+            Query(
+                irods_session, Collection.id, Collection.name, Collection.modify_time
+            ).filter(Collection.parent_name == collection_path),
+            Collection.id,
+            Collection.name,
+            Collection.modify_time,
+        ),
+        digest(
+            Query(
+                irods_session, DataObject.id, DataObject.name, DataObject.modify_time
+            ).filter(Collection.name == collection_path),
+            DataObject.id,
+            DataObject.name,
+            DataObject.modify_time,
+        ),
+        digest(
+            Query(irods_session, CollectionMeta.id, CollectionMeta.modify_time).filter(
+                Collection.name == collection_path
+            ),
+            CollectionMeta.id,
+            CollectionMeta.modify_time,
+        ),
+    ]
+
+
+def data_object_fingerprint(irods_session, data_object_path):
+    collection_path, _, name = data_object_path.rpartition("/")
+    criteria = (Collection.name == collection_path, DataObject.name == name)
+    return [
+        sorted_rows(
+            Query(
+                irods_session,
+                DataObject.replica_number,
+                DataObject.modify_time,
+                DataObject.size,
+                DataObject.checksum,
+            ).filter(*criteria),
+            DataObject.replica_number,
+            DataObject.modify_time,
+            DataObject.size,
+            DataObject.checksum,
+        ),
+        sorted_rows(
+            Query(irods_session, DataAccess.user_id, DataAccess.name).filter(*criteria),
+            DataAccess.user_id,
+            DataAccess.name,
+        ),
+        digest(
+            Query(irods_session, DataObjectMeta.id, DataObjectMeta.modify_time).filter(
+                *criteria
+            ),
+            DataObjectMeta.id,
+            DataObjectMeta.modify_time,
+        ),
+    ]
+
+
+def view_etag(fingerprint, template):
+    """ETag for the current request, or None when it should not be answered from cache
+
+    fingerprint is a callable, its catalog queries only run when ETags are enabled
+    """
+    if not MANGO_VIEW_ETAGS or session.get("_flashes"):
+        # flashed messages are shown once, a 304 would swallow them
+        return None
+    parts = [
+        request.full_path,
+        g.irods_session.username,
+        template,
+        int(time.time() // MANGO_VIEW_ETAG_TTL),
+        fingerprint(),
+    ]
+    return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def is_not_modified(etag):
+    return etag is not None and etag in request.if_none_match
+
+
+def not_modified(etag):
+    return with_etag(Response(status=304), etag)
+
+
+def with_etag(rv, etag):
+    """Response for the view return value rv, carrying etag if there is one"""
+    response = make_response(rv)
+    if etag is not None:
+        response.set_etag(etag)
+        # always revalidate, the page is specific for the user
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
@@ -0,0 +1,407 @@
+# Lightweight listing of the direct children of a collection
+#
+# Instead of building full PRC collection and data object instances (with their replica
+# objects) only the columns the views show are fetched, into compact named tuples. A
+# complete listing takes one GenQuery for the sub collections and one for the data
+# objects, GenQuery returns one row per replica for the replica specific columns so data
+# objects are deduplicated in memory.
+#
+# The paged listing puts the sub collections first, then the data objects, as in the
+# classic collection view. Every page is fetched with GenQuery limit/offset, so the first
+# page costs the same whatever the size of the collection. Data objects are paged on their
+# id in a first query and the displayed columns are fetched for that page only.
+
+import os
+from itertools import islice
+from collections import namedtuple
+
+from irods.column import In, Like, Criterion
+from irods.models import Collection, DataObject
+from irods.query import Query
+
+LISTING_PAGE_SIZE = int(os.environ.get("MANGO_LISTING_PAGE_SIZE", 250))
+LISTING_MAX_PAGE_SIZE = int(os.environ.get("MANGO_LISTING_MAX_PAGE_SIZE", 2000))
+TREE_MAX_DEPTH = int(os.environ.get("MANGO_TREE_MAX_DEPTH", 5))
+SORT_KEYS = ("name", "size", "modify_time")
+SORT_ORDERS = ("asc", "desc")
+# number of ids in one In() condition, keeps the GenQuery condition string short
+ID_BATCH_SIZE = 50
+
+CollectionRow = namedtuple(
+    "CollectionRow", ["id", "path", "name", "owner_name", "create_time", "modify_time"]
+)
+DataObjectRow = namedtuple(
+    "DataObjectRow",
+    [
+        "id",
+        "path",
+        "name",
+        "owner_name",
+        "size",
+        "create_time",
+        "modify_time",
+        "comments",
+    ],
+)
+
+Listing = namedtuple(
+    "Listing",
+    [
+        "sub_collections",
+        "data_objects",
+        "page",
+        "page_size",
+        "sort",
+        "order",
+        "has_more",
+    ],
+)
+
+COLLECTION_SORT_COLUMNS = {
+    "name": Collection.name,
+    # collections have no size of their own
+    "size": Collection.name,
+    "modify_time": Collection.modify_time,
+}
+DATA_OBJECT_SORT_COLUMNS = {
+    "name": DataObject.name,
+    "size": DataObject.size,
+    "modify_time": DataObject.modify_time,
+}
+
+
+def parse_listing_args(args, allow_unpaged=False):
+    """page, page_size, sort and order from request args, clamped to sane values
+
+    With allow_unpaged, page_size 0 asks for the complete listing
+    """
+    try:
+        page = max(1, int(args.get("page", 1)))
+    except ValueError:
+        page = 1
+    try:
+        page_size = int(args.get("page_size", LISTING_PAGE_SIZE))
+        if not (allow_unpaged and page_size == 0):
+            page_size = min(LISTING_MAX_PAGE_SIZE, max(1, page_size))
+    except ValueError:
+        page_size = LISTING_PAGE_SIZE
+    sort = args.get("sort", "name")
+    if sort not in SORT_KEYS:
+        sort = "name"
+    order = args.get("order", "asc")
+    if order not in SORT_ORDERS:
+        order = "asc"
+    return page, page_size, sort, order
+
+
+def collection_row(row):
+    return CollectionRow(
+        id=row[Collection.id],
+        path=row[Collection.name],
+        name=row[Collection.name].rsplit("/", 1)[-1],
+        owner_name=row[Collection.owner_name],
+        create_time=row[Collection.create_time],
+        modify_time=row[Collection.modify_time],
+    )
+
+
+def page_rows(query, offset, limit):
+    """The rows of one page, over as many GenQuery batches as the server needs for it
+
+    limit only sets the batch size, a server that caps it returns the rest of the page in
+    further batches
+    """
+    return list(islice(query.offset(offset).limit(limit), limit))
+
+
+def ordered_query(query, sort_column, name_column, order):
+    query = query.order_by(sort_column, order)
+    if sort_column is not name_column:
+        # stable order within equal sizes or timestamps
+        query = query.order_by(name_column, order)
+    return query
+
+
+def list_sub_collections_page(
+    irods_session, collection_path, offset, limit, sort, order
+):
+    query = ordered_query(
+        sub_collection_query(irods_session, collection_path),
+        COLLECTION_SORT_COLUMNS[sort],
+        Collection.name,
+        order,
+    )
+    return [
+        collection_row(row)
+        for row in page_rows(query, offset, limit)
+        # the root collection is its own parent
+        if row[Collection.name] != collection_path
+    ]
+
+
+def sub_collection_query(irods_session, collection_path):
+    return Query(
+        irods_session,
+        Collection.id,
+        Collection.owner_name,
+        Collection.create_time,
+        Collection.modify_time,
+    ).filter(Collection.parent_name == collection_path)
+
+
+def data_object_query(irods_session, collection_path):
+    return Query(
+        irods_session,
+        DataObject.id,
+        DataObject.name,
+        DataObject.owner_name,
+        DataObject.size,
+        DataObject.create_time,
+        DataObject.modify_time,
+        DataObject.comments,
+    ).filter(Collection.name == collection_path)
+
+
+def data_object_row(collection_path, row):
+    return DataObjectRow(
+        id=row[DataObject.id],
+        path=f"{collection_path.rstrip('/')}/{row[DataObject.name]}",
+        name=row[DataObject.name],
+        owner_name=row[DataObject.owner_name],
+        size=row[DataObject.size],
+        create_time=row[DataObject.create_time],
+        modify_time=row[DataObject.modify_time],
+        comments=row[DataObject.comments],
+    )
+
+
+def data_object_rows(collection_path, results) -> dict:
+    """DataObjectRow per data object id, out of GenQuery results with a row per replica"""
+    rows = {}
+    for row in results:
+        replica_row = data_object_row(collection_path, row)
+        # show the most recently modified replica
+        previous = rows.get(replica_row.id)
+        if previous is None or previous.modify_time < replica_row.modify_time:
+            rows[replica_row.id] = replica_row
+    return rows
+
+
+def list_sub_collections(irods_session, collection_path):
+    """All sub collections of collection_path as CollectionRow, sorted on name"""
+    return [
+        collection_row(row)
+        for row in sub_collection_query(irods_session, collection_path).order_by(
+            Collection.name
+        )
+        if row[Collection.name] != collection_path
+    ]
+
+
+def list_data_objects(irods_session, collection_path):
+    """All data objects in collection_path as DataObjectRow, sorted on name"""
+    return sorted(
+        data_object_rows(
+            collection_path,
+            data_object_query(irods_session, collection_path).get_results(),
+        ).values(),
+        key=lambda row: row.name,
+    )
+
+
+def iter_sub_collections(irods_session, collection_path, order="asc"):
+    """Generator of the sub collections of collection_path, sorted on name
+
+    Rows are read from the catalog batch per batch while iterating, for streamed views
+    """
+    for row in sub_collection_query(irods_session, collection_path).order_by(
+        Collection.name, order
+    ):
+        if row[Collection.name] != collection_path:
+            yield collection_row(row)
+
+
+def iter_data_objects(irods_session, collection_path, order="asc"):
+    """Generator of the data objects in collection_path, sorted on name
+
+    Sorted on name, the replica rows of a data object are adjacent and can be folded
+    without keeping the listing in memory.
+    """
+    current = None
+    for row in data_object_query(irods_session, collection_path).order_by(
+        DataObject.name, order
+    ):
+        replica_row = data_object_row(collection_path, row)
+        if current is not None and current.id != replica_row.id:
+            yield current
+            current = None
+        if current is None or current.modify_time < replica_row.modify_time:
+            current = replica_row
+    if current is not None:
+        yield current
+
+
+def list_collection_contents(irods_session, collection_path):
+    """(sub collections, data objects) of collection_path, one GenQuery each"""
+    return (
+        list_sub_collections(irods_session, collection_path),
+        list_data_objects(irods_session, collection_path),
+    )
+
+
+def count_sub_collections(irods_session, collection_path):
+    count = (
+        Query(irods_session, Collection.id)
+        .filter(Collection.parent_name == collection_path)
+        .count(Collection.id)
+        .one()[Collection.id]
+    )
+    return count - (1 if collection_path == "/" else 0)
+
+
+def list_data_objects_page(irods_session, collection_path, offset, limit, sort, order):
+    query = Query(irods_session, DataObject.id).filter(
+        Collection.name == collection_path
+    )
+    query = ordered_query(query, DATA_OBJECT_SORT_COLUMNS[sort], DataObject.name, order)
+    data_object_ids = []
+    for row in page_rows(query, offset, limit):
+        # replicas with a diverging size or modify time show up more than once
+        if row[DataObject.id] not in data_object_ids:
+            data_object_ids.append(row[DataObject.id])
+
+    details = {}
+    for start in range(0, len(data_object_ids), ID_BATCH_SIZE):
+        details.update(
+            data_object_rows(
+                collection_path,
+                data_object_query(irods_session, collection_path)
+                .filter(
+                    In(DataObject.id, data_object_ids[start : start + ID_BATCH_SIZE])
+                )
+                .get_results(),
+            )
+        )
+    return [
+        details[data_object_id]
+        for data_object_id in data_object_ids
+        if data_object_id in details
+    ]
+
+
+def list_collection_page(
+    irods_session,
+    collection_path,
+    page=1,
+    page_size=LISTING_PAGE_SIZE,
+    sort="name",
+    order="asc",
+) -> Listing:
+    """One page of the children of collection_path, sub collections first
+
+    Every query asks for one row more than needed to find out whether there is a next
+    page, the sub collections are only counted when the page starts past them.
+    """
+    offset = (page - 1) * page_size
+    sub_collections = list_sub_collections_page(
+        irods_session, collection_path, offset, page_size + 1, sort, order
+    )
+    if len(sub_collections) > page_size:
+        return Listing(
+            sub_collections[:page_size], [], page, page_size, sort, order, True
+        )
+    if sub_collections or offset == 0:
+        data_object_offset = 0
+    else:
+        data_object_offset = offset - count_sub_collections(
+            irods_session, collection_path
+        )
+    remaining = page_size - len(sub_collections)
+    data_objects = list_data_objects_page(
+        irods_session,
+        collection_path,
+        data_object_offset,
+        remaining + 1,
+        sort,
+        order,
+    )
+    return Listing(
+        sub_collections,
+        data_objects[:remaining],
+        page,
+        page_size,
+        sort,
+        order,
+        len(data_objects) > remaining,
+    )
+
+
+def stream_collection_listing(irods_session, collection_path, order="asc") -> Listing:
+    """The complete listing as a Listing of generators, sorted on name only"""
+    return Listing(
+        iter_sub_collections(irods_session, collection_path, order),
+        iter_data_objects(irods_session, collection_path, order),
+        1,
+        0,
+        "name",
+        order,
+        False,
+    )
+
+
+def list_collection_tree(irods_session, collection_path, depth=1):
+    """Nested sub collections of collection_path up to depth levels, in one GenQuery
+
+    Every node is a dict with path and name, nodes above the requested depth also have
+    a (possibly empty) list of children, nodes at the deepest level have no children key
+    as their sub collections were not looked up.
+    """
+    collection_path = collection_path.rstrip("/") or "/"
+    depth = min(max(1, depth), TREE_MAX_DEPTH)
+    prefix = collection_path.rstrip("/") + "/"
+    if depth == 1:
+        query = Query(irods_session, Collection.name).filter(
+            Collection.parent_name == collection_path
+        )
+    else:
+        # all descendants, except those with depth or more slashes after the prefix
+        query = (
+            Query(irods_session, Collection.name)
+            .filter(Like(Collection.name, f"{prefix}%"))
+            .filter(Criterion("not like", Collection.name, f"{prefix}{'%/' * depth}%"))
+        )
+    tree = {
+        "path": collection_path,
+        "name": collection_path.rsplit("/", 1)[-1],
+        "children": [],
+    }
+    nodes = {collection_path: tree}
+    # sorted on path, parents come before their children
+    for path in sorted(row[Collection.name] for row in query):
+        # _ is a wildcard in a like condition
+        if not path.startswith(prefix) or path == collection_path:
+            continue
+        parent_path, _, name = path.rpartition("/")
+        if (parent := nodes.get(parent_path or "/", None)) is None:
+            continue
+        node = {"path": path, "name": name}
+        if path[len(prefix) :].count("/") < depth - 1:
+            node["children"] = []
+            nodes[path] = node
+        parent["children"].append(node)
+    return tree
+
+
+def tree_to_treeselect(tree):
+    """The id/label/children structure of vue-treeselect"""
+    node = {"id": tree["path"], "label": tree["name"]}
+    if tree.get("children", None):
+        node["children"] = [tree_to_treeselect(child) for child in tree["children"]]
+    return node
+
+
+def listing_row_to_dict(row):
+    return {
+        key: value.isoformat() if hasattr(value, "isoformat") else value
+        for key, value in row._asdict().items()
+    }
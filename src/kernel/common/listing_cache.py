@@ -0,0 +1,351 @@
+# Shared listing and metadata cache for collections
+#
+# The children of a collection (as compact listing rows) and its AVUs are read once with
+# the zone operator session, together with the ids of the users and groups holding an
+# ACL on every item. One cache entry then serves every user: rows are filtered per request
+# against the reader ids of that user (own id plus group ids), so a project root listed by
+# all members of the project group is queried once. The signals in signals.py cover every
+# mutation made through the portal and drop the affected entries, changes made outside
+# the portal show up after MANGO_LISTING_CACHE_TTL seconds.
+#
+# Opt-in via MANGO_LISTING_CACHE=enabled, needs a working operator session for the zone.
+# Collections with more than MANGO_LISTING_CACHE_MAX_ITEMS children are not cached and
+# keep using the paged GenQueries.
+
+import os
+import logging
+
+from irods.query import Query
+from irods.column import In
+from irods.models import (
+    Collection,
+    CollectionAccess,
+    DataObject,
+    DataAccess,
+)
+
+import signals
+from cache import cache
+from kernel.common.listing import (
+    Listing,
+    CollectionRow,
+    collection_row,
+    data_object_row,
+    list_collection_page,
+    list_sub_collections,
+    list_collection_tree,
+)
+
+MANGO_LISTING_CACHE = (
+    os.environ.get("MANGO_LISTING_CACHE", "disabled").lower() == "enabled"
+)
+MANGO_LISTING_CACHE_TTL = int(os.environ.get("MANGO_LISTING_CACHE_TTL", 120))
+MANGO_LISTING_CACHE_MAX_ITEMS = int(
+    os.environ.get("MANGO_LISTING_CACHE_MAX_ITEMS", 5000)
+)
+# per user cache of collection trees, 0 disables
+MANGO_TREE_CACHE_TTL = int(os.environ.get("MANGO_TREE_CACHE_TTL", 60))
+# access levels that allow to see an item, irods 4.2 and 4.3 spellings
+READ_ACCESS_NAMES = [
+    "read object",
+    "read_object",
+    "read",
+    "modify object",
+    "modify_object",
+    "write",
+    "own",
+]
+
+SORT_KEYS = {
+    "name": lambda row: row.name,
+    "size": lambda row: row.size,
+    "modify_time": lambda row: row.modify_time,
+}
+
+
+def get_operator_session(zone):
+    # imported late, the operator plugin is optional
+    try:
+        from plugins.operator import get_zone_operator_session
+
+        return get_zone_operator_session(zone)
+    except Exception as e:
+        logging.warning(f"Listing cache: no operator session for zone {zone}: {e}")
+        return None
+
+
+def cache_key(zone, kind, path):
+    # the zone generation is raised by recursive changes, dropping all entries at once
+    generation = cache.get(f"listing_cache_generation/{zone}") or 0
+    return f"listing_cache/{generation}/{kind}{path}"
+
+
+def get_reader_ids(irods_session):
+    """ids that grant the current user read access, None for rodsadmins who see all"""
+    if irods_session.user.type == "rodsadmin":
+        return None
+    return set([irods_session.user.id, *irods_session.my_group_ids])
+
+
+def is_readable(readers, reader_ids):
+    return reader_ids is None or not reader_ids.isdisjoint(readers)
+
+
+def load_listing(operator_session, collection_path):
+    """Cache entry for collection_path, or an entry marked too_large"""
+    item_count = 0
+    for id_column, criterion in [
+        (Collection.id, Collection.parent_name == collection_path),
+        (DataObject.id, Collection.name == collection_path),
+    ]:
+        item_count += int(
+            Query(operator_session, id_column)
+            .filter(criterion)
+            .count(id_column)
+            .one()[id_column]
+        )
+    if item_count > MANGO_LISTING_CACHE_MAX_ITEMS:
+        return {"too_large": True}
+
+    readers = set(
+        row[CollectionAccess.user_id]
+        for row in Query(
+            operator_session, CollectionAccess.user_id, CollectionAccess.name
+        )
+        .filter(Collection.name == collection_path)
+        .filter(In(CollectionAccess.name, READ_ACCESS_NAMES))
+    )
+
+    sub_collections = {}
+    for row in (
+        Query(
+            operator_session,
+            Collection.id,
+            Collection.name,
+            Collection.owner_name,
+            Collection.create_time,
+            Collection.modify_time,
+            CollectionAccess.user_id,
+        )
+        .filter(Collection.parent_name == collection_path)
+        .filter(In(CollectionAccess.name, READ_ACCESS_NAMES))
+    ):
+        if row[Collection.name] == collection_path:
+            continue
+        _, item_readers = sub_collections.setdefault(
+            row[Collection.id], (collection_row(row), set())
+        )
+        item_readers.add(row[CollectionAccess.user_id])
+
+    data_objects = {}
+    for row in (
+        Query(
+            operator_session,
+            DataObject.id,
+            DataObject.name,
+            DataObject.owner_name,
+            DataObject.size,
+            DataObject.create_time,
+            DataObject.modify_time,
+            DataObject.comments,
+            DataAccess.user_id,
+        )
+        .filter(Collection.name == collection_path)
+        .filter(In(DataAccess.name, READ_ACCESS_NAMES))
+    ):
+        replica_row = data_object_row(collection_path, row)
+        previous, item_readers = data_objects.get(replica_row.id, (None, set()))
+        item_readers.add(row[DataAccess.user_id])
+        # show the most recently modified replica
+        if previous is None or previous.modify_time < replica_row.modify_time:
+            previous = replica_row
+        data_objects[replica_row.id] = (previous, item_readers)
+
+    return {
+        "too_large": False,
+        "readers": readers,
+        "sub_collections": sorted(
+            sub_collections.values(), key=lambda item: item[0].name
+        ),
+        "data_objects": sorted(data_objects.values(), key=lambda item: item[0].name),
+    }
+
+
+def get_listing_entry(zone, collection_path):
+    key = cache_key(zone, "listing", collection_path)
+    entry = cache.get(key)
+    if entry is None:
+        operator_session = get_operator_session(zone)
+        if operator_session is None:
+            return None
+        entry = load_listing(operator_session, collection_path)
+        cache.set(key, entry, timeout=MANGO_LISTING_CACHE_TTL)
+    return entry
+
+
+def get_readable_listing(irods_session, collection_path):
+    """(sub collection rows, data object rows) the current user can read, None if not cached"""
+    if not MANGO_LISTING_CACHE:
+        return None
+    entry = get_listing_entry(irods_session.zone, collection_path)
+    if entry is None or entry["too_large"]:
+        return None
+    reader_ids = get_reader_ids(irods_session)
+    if not is_readable(entry["readers"], reader_ids):
+        # let the catalog decide what to show, or refuse
+        return None
+    return (
+        [
+            row
+            for (row, readers) in entry["sub_collections"]
+            if is_readable(readers, reader_ids)
+        ],
+        [
+            row
+            for (row, readers) in entry["data_objects"]
+            if is_readable(readers, reader_ids)
+        ],
+    )
+
+
+def get_collection_page(
+    irods_session, collection_path, page, page_size, sort, order
+) -> Listing:
+    """list_collection_page, served from the cache when possible"""
+    if (listing := get_readable_listing(irods_session, collection_path)) is None:
+        return list_collection_page(
+            irods_session, collection_path, page, page_size, sort, order
+        )
+    sub_collections, data_objects = listing
+    # collections have no size, they stay sorted on name
+    collection_sort = "name" if sort == "size" else sort
+    sub_collections = sorted(
+        sub_collections, key=SORT_KEYS[collection_sort], reverse=order == "desc"
+    )
+    data_objects = sorted(data_objects, key=SORT_KEYS[sort], reverse=order == "desc")
+    offset = (page - 1) * page_size
+    rows = (sub_collections + data_objects)[offset : offset + page_size + 1]
+    page_rows = rows[:page_size]
+    return Listing(
+        [row for row in page_rows if isinstance(row, CollectionRow)],
+        [row for row in page_rows if not isinstance(row, CollectionRow)],
+        page,
+        page_size,
+        sort,
+        order,
+        len(rows) > page_size,
+    )
+
+
+def get_sub_collections(irods_session, collection_path):
+    """list_sub_collections, served from the cache when possible"""
+    if (listing := get_readable_listing(irods_session, collection_path)) is None:
+        return list_sub_collections(irods_session, collection_path)
+    return listing[0]
+
+
+def get_collection_metadata(irods_session, collection):
+    """AVUs (with timestamps) of collection, served from the cache when possible"""
+    if not MANGO_LISTING_CACHE:
+        return collection.metadata(timestamps=True).items()
+    entry = get_listing_entry(irods_session.zone, collection.path)
+    if entry is None or entry["too_large"]:
+        return collection.metadata(timestamps=True).items()
+    if not is_readable(entry["readers"], get_reader_ids(irods_session)):
+        return collection.metadata(timestamps=True).items()
+    key = cache_key(irods_session.zone, "metadata", collection.path)
+    if (metadata_items := cache.get(key)) is None:
+        metadata_items = collection.metadata(timestamps=True).items()
+        cache.set(key, metadata_items, timeout=MANGO_LISTING_CACHE_TTL)
+    return metadata_items
+
+
+def invalidate_collection(zone, collection_path):
+    cache.delete_many(
+        cache_key(zone, "listing", collection_path),
+        cache_key(zone, "metadata", collection_path),
+    )
+
+
+def invalidate_zone(zone):
+    key = f"listing_cache_generation/{zone}"
+    cache.set(key, (cache.get(key) or 0) + 1, timeout=0)
+
+
+def get_collection_tree(irods_session, collection_path, depth):
+    """list_collection_tree, cached per user for MANGO_TREE_CACHE_TTL seconds"""
+    if MANGO_TREE_CACHE_TTL <= 0:
+        return list_collection_tree(irods_session, collection_path, depth)
+    generation = cache.get(f"tree_cache_generation/{irods_session.zone}") or 0
+    key = f"collection_tree/{generation}/{irods_session.username}/{depth}{collection_path}"
+    if (tree := cache.get(key)) is None:
+        tree = list_collection_tree(irods_session, collection_path, depth)
+        cache.set(key, tree, timeout=MANGO_TREE_CACHE_TTL)
+    return tree
+
+
+def tree_changed_listener(sender, **parameters):
+    """Any change to the collection structure drops all cached trees of the zone"""
+    if MANGO_TREE_CACHE_TTL <= 0 or "irods_session" not in parameters:
+        return
+    key = f"tree_cache_generation/{parameters['irods_session'].zone}"
+    cache.set(key, (cache.get(key) or 0) + 1, timeout=0)
+
+
+PATH_PARAMETERS = [
+    "collection_path",
+    "data_object_path",
+    "item_path",
+    "original_path",
+    "new_path",
+]
+
+
+def catalog_changed_listener(sender, **parameters):
+    """Drops the cached listing and metadata of every path in the signal, and of its parent"""
+    if not MANGO_LISTING_CACHE or "irods_session" not in parameters:
+        return
+    zone = parameters["irods_session"].zone
+    if parameters.get("recursive", False):
+        invalidate_zone(zone)
+        return
+    for parameter in PATH_PARAMETERS:
+        if path := parameters.get(parameter, None):
+            # some senders pass PurePath objects
+            path = str(path).rstrip("/")
+            invalidate_collection(zone, path)
+            invalidate_collection(zone, path.rsplit("/", 1)[0] or "/")
+
+
+for signal in [
+    signals.collection_changed,
+    signals.collection_added,
+    signals.subtree_added,
+    signals.collection_trashed,
+    signals.collection_deleted,
+    signals.collection_moved,
+    signals.collection_copied,
+    signals.collection_renamed,
+    signals.data_object_changed,
+    signals.data_object_trashed,
+    signals.data_object_deleted,
+    signals.data_object_moved,
+    signals.data_object_copied,
+    signals.data_object_renamed,
+    signals.metadata_changed,
+    signals.metadata_deleted,
+    signals.permissions_changed,
+]:
+    signal.connect(catalog_changed_listener)
+
+for signal in [
+    signals.collection_added,
+    signals.subtree_added,
+    signals.collection_trashed,
+    signals.collection_deleted,
+    signals.collection_moved,
+    signals.collection_copied,
+    signals.collection_renamed,
+    signals.permissions_changed,
+]:
+    signal.connect(tree_changed_listener)
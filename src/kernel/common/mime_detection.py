@@ -0,0 +1,175 @@
+# Background detection of the MIME type of data objects
+#
+# Sniffing the MIME type means reading the start of the data object from iRODS, too slow
+# for the request that renders a page. Data objects without the <MANGO_PREFIX>.mime_type
+# AVU are put on a queue, by the data_object_added signal and by the data object view,
+# which then shows a placeholder. A dispatcher thread takes the queue in batches of up to
+# MANGO_MIME_DETECTION_BATCH_SIZE, skips the objects that meanwhile got the AVU (one
+# GenQuery per batch) and sniffs the others on a pool of MANGO_MIME_DETECTION_THREADS.
+# The work runs with an idle pooled session of the user that queued the object, or else
+# with the operator session of the zone.
+#
+# Opt-in via MANGO_ASYNC_MIME_DETECTION=enabled, otherwise the view detects in place.
+
+import os
+import queue
+import logging
+from threading import Lock, Thread
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import magic
+from flask import current_app, session, has_request_context
+from irods.column import In
+from irods.meta import iRODSMeta
+from irods.models import Collection, DataObject, DataObjectMeta
+
+import signals
+import irods_session_pool
+
+MANGO_ASYNC_MIME_DETECTION = (
+    os.environ.get("MANGO_ASYNC_MIME_DETECTION", "disabled").lower() == "enabled"
+)
+MANGO_MIME_DETECTION_THREADS = int(os.environ.get("MANGO_MIME_DETECTION_THREADS", 4))
+MANGO_MIME_DETECTION_BATCH_SIZE = int(
+    os.environ.get("MANGO_MIME_DETECTION_BATCH_SIZE", 50)
+)
+# bytes read from the start of the data object
+MIME_SAMPLE_SIZE = 50 * 1024
+
+mime_queue = queue.Queue()
+# (zone, path) of the queued objects, an object is queued once until it is processed
+pending = set()
+pending_lock = Lock()
+dispatcher = None
+
+detection_executor = ThreadPoolExecutor(
+    max_workers=MANGO_MIME_DETECTION_THREADS, thread_name_prefix="mango-mime"
+)
+
+
+def mime_type_attribute_name():
+    return f"{current_app.config['MANGO_PREFIX']}.mime_type"
+
+
+def detect_mime_type(irods_session, data_object_path):
+    with irods_session.data_objects.open(data_object_path, "r") as f:
+        sample = f.read(MIME_SAMPLE_SIZE)
+    return magic.from_buffer(sample, mime=True)
+
+
+def detect_and_set(irods_session, data_object_path, attribute_name, admin):
+    try:
+        mime_type = detect_mime_type(irods_session, data_object_path)
+        data_object = irods_session.data_objects.get(data_object_path)
+        data_object.metadata(admin=admin).set(iRODSMeta(attribute_name, mime_type))
+        logging.info(f"Detected mime type {mime_type} for {data_object_path}")
+    except Exception as e:
+        logging.warning(f"Could not detect the mime type of {data_object_path}: {e}")
+
+
+def without_mime_type(irods_session, data_object_paths, attribute_name):
+    """The data object paths that do not have the mime type AVU yet"""
+    with_mime_type = set(
+        f"{row[Collection.name]}/{row[DataObject.name]}"
+        for row in irods_session.query(Collection.name, DataObject.name).filter(
+            DataObjectMeta.name == attribute_name,
+            In(
+                Collection.name,
+                list(set(p.rsplit("/", 1)[0] for p in data_object_paths)),
+            ),
+            In(
+                DataObject.name,
+                list(set(p.rsplit("/", 1)[1] for p in data_object_paths)),
+            ),
+        )
+    )
+    return [path for path in data_object_paths if path not in with_mime_type]
+
+
+def checkout_session(zone, session_id):
+    """(irods session, user session to check it in with or None, admin mode) or None"""
+    user_session = irods_session_pool.irods_user_sessions.get(session_id, None)
+    if user_session is not None:
+        if (irods_session := user_session.checkout_spare()) is not None:
+            return (irods_session, user_session, False)
+    try:
+        from plugins.operator import get_zone_operator_session
+
+        if (operator_session := get_zone_operator_session(zone)) is not None:
+            return (operator_session, None, True)
+    except Exception:
+        pass
+    return None
+
+
+def process_batch(zone, session_id, attribute_name, data_object_paths):
+    if (checked_out := checkout_session(zone, session_id)) is None:
+        logging.info(f"No session for mime type detection of {data_object_paths}")
+        return
+    irods_session, user_session, admin = checked_out
+    try:
+        futures = [
+            detection_executor.submit(
+                detect_and_set, irods_session, path, attribute_name, admin
+            )
+            for path in without_mime_type(
+                irods_session, data_object_paths, attribute_name
+            )
+        ]
+        wait(futures)
+    except Exception as e:
+        logging.warning(f"Mime type detection batch failed: {e}")
+    finally:
+        if user_session is not None:
+            user_session.checkin(irods_session, touch=False)
+
+
+def dispatch():
+    while True:
+        batch = [mime_queue.get()]
+        while len(batch) < MANGO_MIME_DETECTION_BATCH_SIZE:
+            try:
+                batch.append(mime_queue.get_nowait())
+            except queue.Empty:
+                break
+        batches = {}
+        for zone, session_id, attribute_name, path in batch:
+            batches.setdefault((zone, session_id, attribute_name), []).append(path)
+        for (zone, session_id, attribute_name), paths in batches.items():
+            process_batch(zone, session_id, attribute_name, paths)
+            with pending_lock:
+                pending.difference_update((zone, path) for path in paths)
+
+
+def queue_mime_detection(zone, data_object_path, attribute_name=None):
+    """Queues the data object for mime type detection, from within a request"""
+    global dispatcher
+    if attribute_name is None:
+        attribute_name = mime_type_attribute_name()
+    session_id = session.get("userid", None) if has_request_context() else None
+    with pending_lock:
+        if (zone, data_object_path) in pending:
+            return
+        pending.add((zone, data_object_path))
+        if dispatcher is None:
+            dispatcher = Thread(
+                target=dispatch, name="mango-mime-dispatch", daemon=True
+            )
+            dispatcher.start()
+    mime_queue.put((zone, session_id, attribute_name, data_object_path))
+
+
+def data_object_added_listener(sender, **parameters):
+    if not MANGO_ASYNC_MIME_DETECTION or "data_object_path" not in parameters:
+        return
+    data_object_path = parameters["data_object_path"]
+    if "irods_session" in parameters:
+        zone = parameters["irods_session"].zone
+    else:
+        zone = data_object_path.lstrip("/").split("/", 1)[0]
+    queue_mime_detection(zone, data_object_path)
+
+
+# data_object_added is also sent for metadata changes, objects that already have the
+# mime type are dropped by the batch query
+signals.data_object_added.connect(data_object_added_listener)
@@ -0,0 +1,102 @@
+# Background prefetch of sub collection listings
+#
+# The next click after opening a collection is mostly into one of its sub collections.
+# Once the collection view has been sent, the listing cache entries (listing and AVUs) of
+# its first MANGO_PREFETCH_COLLECTIONS sub collections are warmed on a small thread pool.
+# The prefetch only uses a session of the user pool that happens to be idle, runs at most
+# once every MANGO_PREFETCH_INTERVAL seconds per user, and stops as soon as the user has
+# been inactive for MANGO_PREFETCH_IDLE_TIMEOUT seconds.
+#
+# Opt-in via MANGO_PREFETCH=enabled, only useful together with MANGO_LISTING_CACHE=enabled
+
+import os
+import time
+import logging
+import datetime
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, session, after_this_request
+
+import irods_session_pool
+from kernel.common import listing_cache
+
+MANGO_PREFETCH = os.environ.get("MANGO_PREFETCH", "disabled").lower() == "enabled"
+MANGO_PREFETCH_COLLECTIONS = int(os.environ.get("MANGO_PREFETCH_COLLECTIONS", 5))
+MANGO_PREFETCH_THREADS = int(os.environ.get("MANGO_PREFETCH_THREADS", 4))
+MANGO_PREFETCH_INTERVAL = float(os.environ.get("MANGO_PREFETCH_INTERVAL", 10))
+MANGO_PREFETCH_IDLE_TIMEOUT = float(os.environ.get("MANGO_PREFETCH_IDLE_TIMEOUT", 60))
+
+prefetch_executor = ThreadPoolExecutor(
+    max_workers=MANGO_PREFETCH_THREADS, thread_name_prefix="mango-prefetch"
+)
+# session id -> monotonic time of the last scheduled prefetch
+last_prefetch = {}
+last_prefetch_lock = Lock()
+
+
+def is_prefetch_enabled():
+    return MANGO_PREFETCH and listing_cache.MANGO_LISTING_CACHE
+
+
+def is_idle(user_session):
+    idle_time = datetime.datetime.now() - user_session.last_accessed
+    return idle_time.total_seconds() > MANGO_PREFETCH_IDLE_TIMEOUT
+
+
+def prefetch_collections(app, session_id, collection_paths):
+    with app.app_context():
+        for collection_path in collection_paths:
+            user_session = irods_session_pool.irods_user_sessions.get(session_id, None)
+            if user_session is None or is_idle(user_session):
+                logging.debug(f"Prefetch cancelled for idle session {session_id}")
+                return
+            irods_session = user_session.checkout_spare()
+            if irods_session is None:
+                # all sessions serve requests, these have priority
+                return
+            try:
+                collection = irods_session.collections.get(collection_path)
+                listing_cache.get_collection_metadata(irods_session, collection)
+            except Exception as e:
+                logging.info(f"Prefetch of {collection_path} failed: {e}")
+            finally:
+                user_session.checkin(irods_session, touch=False)
+
+
+def schedule_prefetch(app, session_id, collection_paths):
+    """Warms the listing cache for the given collections in the background, rate limited"""
+    now = time.monotonic()
+    with last_prefetch_lock:
+        if now - last_prefetch.get(session_id, 0) < MANGO_PREFETCH_INTERVAL:
+            return
+        last_prefetch[session_id] = now
+        # forget the users that did not browse for a while
+        for stale_session_id in [
+            key
+            for key, scheduled in last_prefetch.items()
+            if now - scheduled > MANGO_PREFETCH_IDLE_TIMEOUT
+        ]:
+            del last_prefetch[stale_session_id]
+    prefetch_executor.submit(
+        prefetch_collections,
+        app,
+        session_id,
+        collection_paths[:MANGO_PREFETCH_COLLECTIONS],
+    )
+
+
+def prefetch_after_response(collection_paths):
+    """Schedules the prefetch for when the response of the current request has been sent"""
+    if not is_prefetch_enabled() or not collection_paths or "userid" not in session:
+        return
+    app = current_app._get_current_object()
+    session_id = session["userid"]
+
+    @after_this_request
+    def schedule_on_close(response):
+        # close callbacks run outside the app context, hence app is passed along
+        response.call_on_close(
+            lambda: schedule_prefetch(app, session_id, collection_paths)
+        )
+        return response
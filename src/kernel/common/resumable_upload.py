@@ -0,0 +1,267 @@
+# Resumable chunked uploads
+#
+# A tus-like protocol for large files: an upload is created with its target collection,
+# file name and size, then chunks are sent at byte offsets in any order (and from parallel
+# requests), and the upload is finalized once every byte has arrived. Chunks are written
+# at their offset into a partial data object <collection>/.<name>.upload-<id>, which
+# finalizing puts at <collection>/<name> as a streaming upload does. A failed chunk is
+# simply sent again, the server keeps the received byte ranges so a client can ask where
+# to resume.
+#
+# The upload state is a json file in storage/resumable_uploads, it survives restarts and
+# is visible to every worker process. Its updates are serialized with an flock on
+# <id>.lock, shared storage needs to support flock for several nodes. An iRODS replica
+# takes one writer at a time, so the chunks of an upload are also written to the partial
+# data object under that lock. Parallel chunks are received into a local spool file (in
+# memory up to SPOOL_MEMORY_SIZE) and checksummed outside of it, only the write to iRODS
+# and recording the range are serialized. Uploads not touched for
+# MANGO_RESUMABLE_UPLOAD_TTL seconds are removed when their user starts a new upload.
+#
+# Opt-in via MANGO_RESUMABLE_UPLOADS=enabled, the collection view then uploads through it
+
+import os
+import json
+import time
+import uuid
+import base64
+import hashlib
+import fcntl
+import logging
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+
+from flask import abort
+from werkzeug.exceptions import HTTPException
+
+from kernel.common.upload import move_into_place
+
+MANGO_RESUMABLE_UPLOADS = (
+    os.environ.get("MANGO_RESUMABLE_UPLOADS", "disabled").lower() == "enabled"
+)
+MANGO_RESUMABLE_UPLOAD_TTL = int(
+    os.environ.get("MANGO_RESUMABLE_UPLOAD_TTL", 24 * 60 * 60)
+)
+MANGO_RESUMABLE_MAX_CHUNK_SIZE = int(
+    os.environ.get("MANGO_RESUMABLE_MAX_CHUNK_SIZE", 64 * 1024 * 1024)
+)
+STATE_PATH = Path("storage") / "resumable_uploads"
+# bytes taken from the request stream per write
+WRITE_SIZE = 4 * 1024 * 1024
+# larger received chunks are spooled to a temporary file
+SPOOL_MEMORY_SIZE = 8 * 1024 * 1024
+
+
+class ChunkChecksumMismatch(HTTPException):
+    """460 as in tus, werkzeug has no exception of its own for it"""
+
+    code = 460
+    name = "Checksum Mismatch"
+    description = "Chunk checksum mismatch"
+
+
+@contextmanager
+def upload_lock(upload_id):
+    """Exclusive access to the state of the upload, across processes"""
+    STATE_PATH.mkdir(parents=True, exist_ok=True)
+    with open(STATE_PATH / f"{upload_id}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def state_file(upload_id):
+    return STATE_PATH / f"{upload_id}.json"
+
+
+def save_state(state):
+    state["updated"] = time.time()
+    STATE_PATH.mkdir(parents=True, exist_ok=True)
+    temp_file = state_file(state["id"]).with_suffix(".tmp")
+    temp_file.write_text(json.dumps(state))
+    # atomic, readers never see a partially written state
+    temp_file.replace(state_file(state["id"]))
+
+
+def drop_state(upload_id):
+    state_file(upload_id).unlink(missing_ok=True)
+    (STATE_PATH / f"{upload_id}.lock").unlink(missing_ok=True)
+
+
+def merge_range(ranges, start, stop):
+    """ranges ([start, stop] lists, sorted and disjoint) with [start, stop) added"""
+    merged = []
+    for range_start, range_stop in sorted(ranges + [[start, stop]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_stop)
+        else:
+            merged.append([range_start, range_stop])
+    return merged
+
+
+def progress(state):
+    """The public view of an upload"""
+    received = sum(stop - start for (start, stop) in state["received"])
+    return {
+        "id": state["id"],
+        "collection": state["collection"],
+        "filename": state["filename"],
+        "size": state["size"],
+        "received": state["received"],
+        "bytes_received": received,
+        "complete": received == state["size"],
+    }
+
+
+def get_upload(irods_session, upload_id) -> dict:
+    """State of the upload, 404 if it does not exist or belongs to someone else"""
+    try:
+        state = json.loads(state_file(str(uuid.UUID(upload_id))).read_text())
+    except (ValueError, OSError):
+        abort(404, "Upload not found")
+    if (state["zone"], state["username"]) != (
+        irods_session.zone,
+        irods_session.username,
+    ):
+        abort(404, "Upload not found")
+    return state
+
+
+def remove_expired_uploads(irods_session):
+    if not STATE_PATH.exists():
+        return
+    for path in STATE_PATH.glob("*.json"):
+        try:
+            state = json.loads(path.read_text())
+        except (ValueError, OSError):
+            continue
+        if (state["zone"], state["username"]) != (
+            irods_session.zone,
+            irods_session.username,
+        ) or time.time() - state["updated"] < MANGO_RESUMABLE_UPLOAD_TTL:
+            continue
+        logging.info(
+            f"Removing expired upload {state['id']} of {state['partial_path']}"
+        )
+        abort_upload(irods_session, state["id"])
+
+
+def create_upload(irods_session, collection, filename, size, upload_id=None) -> dict:
+    """Starts an upload, upload_id can be given by clients that pick their own (uuid)"""
+    remove_expired_uploads(irods_session)
+    filename = os.path.basename(filename)
+    if not filename or size < 0:
+        abort(400, "A file name and size are required")
+    collection = collection.rstrip("/")
+    try:
+        upload_id = str(uuid.UUID(upload_id)) if upload_id else str(uuid.uuid4())
+    except ValueError:
+        abort(400, f"Invalid upload id {upload_id}")
+    partial_path = f"{collection}/.{filename}.upload-{upload_id}"
+    irods_session.data_objects.create(partial_path)
+    state = {
+        "id": upload_id,
+        "zone": irods_session.zone,
+        "username": irods_session.username,
+        "collection": collection,
+        "filename": filename,
+        "partial_path": partial_path,
+        "size": size,
+        "received": [],
+        "created": time.time(),
+    }
+    save_state(state)
+    return state
+
+
+def get_or_create_upload(irods_session, upload_id, collection, filename, size) -> dict:
+    """For clients that send all chunks right away, the first one to arrive creates it"""
+    try:
+        upload_id = str(uuid.UUID(upload_id))
+    except ValueError:
+        abort(400, f"Invalid upload id {upload_id}")
+    with upload_lock(upload_id):
+        if state_file(upload_id).exists():
+            return get_upload(irods_session, upload_id)
+        return create_upload(irods_session, collection, filename, size, upload_id)
+
+
+def chunk_digest(checksum_header):
+    """(hash object, expected digest) for an Upload-Checksum header as in tus"""
+    if not checksum_header:
+        return (None, None)
+    try:
+        algorithm, encoded_digest = checksum_header.split(" ", 1)
+        return (hashlib.new(algorithm), base64.b64decode(encoded_digest))
+    except ValueError:
+        abort(400, f"Unsupported checksum {checksum_header}")
+
+
+def write_chunk(
+    irods_session, upload_id, offset, length, stream, checksum_header=None
+) -> dict:
+    """Writes length bytes of stream at offset into the partial data object
+
+    The range only counts as received when all of it arrived and the optional
+    Upload-Checksum matches, otherwise nothing is written and the client sends the
+    chunk again.
+    """
+    state = get_upload(irods_session, upload_id)
+    if length is None or length > MANGO_RESUMABLE_MAX_CHUNK_SIZE:
+        abort(413, f"Chunks need a length of at most {MANGO_RESUMABLE_MAX_CHUNK_SIZE}")
+    if offset < 0 or offset + length > state["size"]:
+        abort(400, f"Chunk {offset}+{length} outside of {state['size']} bytes")
+    digest, expected_digest = chunk_digest(checksum_header)
+    received = 0
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE) as spool:
+        while received < length:
+            data = stream.read(min(WRITE_SIZE, length - received))
+            if not data:
+                break
+            if digest is not None:
+                digest.update(data)
+            spool.write(data)
+            received += len(data)
+        if received < length:
+            abort(400, f"Chunk at {offset} ended after {received} of {length} bytes")
+        if digest is not None and digest.digest() != expected_digest:
+            raise ChunkChecksumMismatch()
+        spool.seek(0)
+        with upload_lock(state["id"]):
+            # re-read, parallel chunks of this upload may have been recorded meanwhile
+            state = get_upload(irods_session, upload_id)
+            with irods_session.data_objects.open(state["partial_path"], "r+") as f:
+                f.seek(offset)
+                while data := spool.read(WRITE_SIZE):
+                    f.write(data)
+            state["received"] = merge_range(state["received"], offset, offset + length)
+            save_state(state)
+    return state
+
+
+def finalize_upload(irods_session, upload_id) -> str:
+    """Puts the complete partial data object at its final path and returns that path
+
+    An existing data object with the final name is overwritten in place.
+    """
+    with upload_lock(get_upload(irods_session, upload_id)["id"]):
+        state = get_upload(irods_session, upload_id)
+        if not progress(state)["complete"]:
+            abort(409, "Upload is not complete")
+        data_object_path = f"{state['collection']}/{state['filename']}"
+        move_into_place(irods_session, state["partial_path"], data_object_path)
+        drop_state(state["id"])
+    logging.info(f"Resumable upload {upload_id} finalized as {data_object_path}")
+    return data_object_path
+
+
+def abort_upload(irods_session, upload_id):
+    with upload_lock(get_upload(irods_session, upload_id)["id"]):
+        state = get_upload(irods_session, upload_id)
+        try:
+            irods_session.data_objects.unlink(state["partial_path"], force=True)
+        except Exception as e:
+            logging.warning(f"Could not remove {state['partial_path']}: {e}")
+        drop_state(state["id"])
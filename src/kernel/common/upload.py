@@ -0,0 +1,217 @@
+# Streaming upload of files into iRODS
+#
+# The multipart request body is parsed while it is being received and the file part is
+# written straight into an iRODS data object handle, in chunks of MANGO_UPLOAD_CHUNK_SIZE,
+# without a copy on local disk. The data goes into a partial data object
+# <collection>/.<name>.upload-<id>, a SHA-256 and MD5 digest are computed on the fly and
+# compared with the checksum iRODS computes for it. Only then the partial one is renamed
+# into place, or an existing data object with the final name is overwritten from it with a
+# server side copy, so the existing one keeps its id, AVUs and ACLs as with a put. A failed
+# or interrupted upload removes just the partial data object.
+#
+# The form fields collection and csrf_token are needed before the file data arrives, as
+# browsers and dropzone send them. A client that sends the file first is served from a
+# spool file in storage/tmp that is put once the form is complete. The other form fields
+# are kept in memory, at most MAX_FIELDS_SIZE bytes of them.
+#
+# Opt-in via MANGO_STREAMING_UPLOAD=enabled
+
+import os
+import base64
+import hashlib
+import uuid
+import logging
+import tempfile
+from pathlib import Path
+
+from flask import abort
+from irods import keywords as kw
+from flask_wtf.csrf import validate_csrf
+from wtforms import ValidationError
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import (
+    MultipartDecoder,
+    Field,
+    File,
+    Data,
+    Epilogue,
+    NeedData,
+)
+
+MANGO_STREAMING_UPLOAD = (
+    os.environ.get("MANGO_STREAMING_UPLOAD", "disabled").lower() == "enabled"
+)
+MANGO_UPLOAD_CHUNK_SIZE = int(
+    os.environ.get("MANGO_UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024)
+)
+# bytes taken from the request stream per read
+RECEIVE_SIZE = 1024 * 1024
+SPOOL_PATH = Path("storage") / "tmp"
+# total bytes of the non-file form fields, as werkzeug's default max_form_memory_size
+MAX_FIELDS_SIZE = 500 * 1024
+
+
+def can_stream(request):
+    return (
+        MANGO_STREAMING_UPLOAD
+        and request.mimetype == "multipart/form-data"
+        and "boundary" in parse_options_header(request.content_type)[1]
+    )
+
+
+def multipart_events(request):
+    """Generator of the werkzeug multipart events of the request body, as it arrives"""
+    boundary = parse_options_header(request.content_type)[1]["boundary"]
+    decoder = MultipartDecoder(boundary.encode())
+    stream = request.stream
+    while True:
+        received = stream.read(RECEIVE_SIZE)
+        decoder.receive_data(received or None)
+        while not isinstance(event := decoder.next_event(), NeedData):
+            yield event
+            if isinstance(event, Epilogue):
+                return
+        if not received:
+            abort(400, "Incomplete upload")
+
+
+def irods_checksum_matches(irods_checksum, sha256, md5):
+    if irods_checksum.startswith("sha2:"):
+        return irods_checksum[5:] == base64.b64encode(sha256.digest()).decode()
+    return irods_checksum == md5.hexdigest()
+
+
+def move_into_place(irods_session, partial_path, data_object_path):
+    """Puts the complete partial data object at data_object_path
+
+    An existing data object there is overwritten in place, it keeps its id, AVUs and ACLs
+    """
+    if irods_session.data_objects.exists(data_object_path):
+        irods_session.data_objects.copy(
+            partial_path, data_object_path, **{kw.FORCE_FLAG_KW: ""}
+        )
+        irods_session.data_objects.unlink(partial_path, force=True)
+    else:
+        irods_session.data_objects.move(partial_path, data_object_path)
+
+
+class DataObjectWriter:
+    """Buffered writes into a partial data object, with digests computed along the way
+
+    close() puts it at data_object_path, an existing data object there is left untouched
+    until the upload is complete and verified
+    """
+
+    def __init__(self, irods_session, data_object_path):
+        self.irods_session = irods_session
+        self.path = data_object_path
+        collection, name = data_object_path.rsplit("/", 1)
+        self.partial_path = f"{collection}/.{name}.upload-{uuid.uuid4()}"
+        self.handle = irods_session.data_objects.open(self.partial_path, "w")
+        self.buffer = bytearray()
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.md5 = hashlib.md5()
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.md5.update(data)
+        self.size += len(data)
+        self.buffer += data
+        if len(self.buffer) >= MANGO_UPLOAD_CHUNK_SIZE:
+            self.handle.write(self.buffer)
+            self.buffer = bytearray()
+
+    def close(self):
+        """Flushes and closes, verifies the checksum iRODS computes and renames into place"""
+        if self.buffer:
+            self.handle.write(self.buffer)
+        self.handle.close()
+        irods_checksum = self.irods_session.data_objects.chksum(self.partial_path)
+        if not irods_checksum_matches(irods_checksum, self.sha256, self.md5):
+            raise IOError(f"Checksum mismatch for {self.path} after upload")
+        move_into_place(self.irods_session, self.partial_path, self.path)
+
+    def discard(self):
+        try:
+            self.handle.close()
+        except Exception:
+            pass
+        try:
+            self.irods_session.data_objects.unlink(self.partial_path, force=True)
+        except Exception as e:
+            logging.warning(f"Could not remove partial upload {self.partial_path}: {e}")
+
+
+def stream_upload(irods_session, request, file_field="file"):
+    """Receives the upload, returns (form fields, data object path)
+
+    The file is written to <collection>/<filename>, collection being a form field
+    """
+    fields = {}
+    current_field = None
+    writer = None
+    spool_file = None
+    filename = None
+    fields_size = 0
+    try:
+        for event in multipart_events(request):
+            if isinstance(event, Field):
+                current_field = event.name
+                fields[current_field] = b""
+            elif isinstance(event, File):
+                current_field = None
+                if event.name != file_field or filename is not None:
+                    continue
+                filename = os.path.basename(event.filename)
+                current_field = file_field
+                if "collection" in fields and "csrf_token" in fields:
+                    validate_upload_csrf(fields)
+                    writer = DataObjectWriter(
+                        irods_session, f"{fields['collection'].decode()}/{filename}"
+                    )
+                else:
+                    # the form fields come after the file, keep it until they arrive
+                    SPOOL_PATH.mkdir(parents=True, exist_ok=True)
+                    spool_file = tempfile.NamedTemporaryFile(dir=SPOOL_PATH)
+            elif isinstance(event, Data) and current_field is not None:
+                if current_field != file_field:
+                    fields_size += len(event.data)
+                    if fields_size > MAX_FIELDS_SIZE:
+                        abort(413, "Form fields too large")
+                    fields[current_field] += event.data
+                elif writer is not None:
+                    writer.write(event.data)
+                else:
+                    spool_file.write(event.data)
+        if filename is None or "collection" not in fields:
+            abort(400, "Missing file or collection")
+        if writer is None:
+            validate_upload_csrf(fields)
+            spool_file.flush()
+            writer = DataObjectWriter(
+                irods_session, f"{fields['collection'].decode()}/{filename}"
+            )
+            spool_file.seek(0)
+            while data := spool_file.read(MANGO_UPLOAD_CHUNK_SIZE):
+                writer.write(data)
+        writer.close()
+        logging.info(f"Streamed upload of {writer.size} bytes into {writer.path}")
+        return (
+            {name: value.decode() for name, value in fields.items()},
+            writer.path,
+        )
+    except BaseException:
+        if writer is not None:
+            writer.discard()
+        raise
+    finally:
+        if spool_file is not None:
+            spool_file.close()
+
+
+def validate_upload_csrf(fields):
+    try:
+        validate_csrf(fields.get("csrf_token", b"").decode())
+    except ValidationError as e:
+        abort(400, f"Upload refused: {e}")
@@ -0,0 +1,111 @@
+# Zone wide directory of the users and groups: id, name, type and zone
+#
+# Mapping the user ids of ACLs to names and types otherwise takes catalog lookups for
+# every item (PRC reads the complete user table and then the users of the ACL). The
+# directory loads all users and groups of a zone in one GenQuery and is shared by all
+# requests of the process. Once older than MANGO_USER_DIRECTORY_TTL seconds it is still
+# served while a background thread reloads it, an unknown id (a user created since the
+# last load) triggers a reload at most every MANGO_USER_DIRECTORY_MIN_RELOAD seconds.
+
+import os
+import time
+import logging
+from collections import namedtuple
+from threading import Lock, Thread
+
+from irods.models import User
+
+MANGO_USER_DIRECTORY_TTL = int(os.environ.get("MANGO_USER_DIRECTORY_TTL", 300))
+MANGO_USER_DIRECTORY_MIN_RELOAD = int(
+    os.environ.get("MANGO_USER_DIRECTORY_MIN_RELOAD", 10)
+)
+
+DirectoryEntry = namedtuple("DirectoryEntry", ["id", "name", "type", "zone"])
+
+# zone -> (monotonic load time, {id: DirectoryEntry})
+directories = {}
+refreshing = set()
+directory_lock = Lock()
+
+
+def get_operator_session(zone):
+    # imported late, the operator plugin is optional
+    try:
+        from plugins.operator import get_zone_operator_session
+
+        return get_zone_operator_session(zone)
+    except Exception:
+        return None
+
+
+def load_directory(irods_session):
+    return {
+        row[User.id]: DirectoryEntry(
+            row[User.id], row[User.name], row[User.type], row[User.zone]
+        )
+        for row in irods_session.query(User.id, User.name, User.type, User.zone)
+    }
+
+
+def reload_directory(zone, irods_session):
+    entries = load_directory(irods_session)
+    with directory_lock:
+        directories[zone] = (time.monotonic(), entries)
+    return entries
+
+
+def refresh_in_background(zone):
+    def refresh():
+        try:
+            if (operator_session := get_operator_session(zone)) is not None:
+                reload_directory(zone, operator_session)
+        except Exception as e:
+            logging.warning(f"User directory refresh for zone {zone} failed: {e}")
+        finally:
+            with directory_lock:
+                refreshing.discard(zone)
+
+    with directory_lock:
+        if zone in refreshing:
+            return
+        refreshing.add(zone)
+    Thread(target=refresh, name=f"mango-user-directory-{zone}", daemon=True).start()
+
+
+def get_directory(irods_session) -> dict:
+    """{id: DirectoryEntry} of all users and groups in the zone of irods_session"""
+    zone = irods_session.zone
+    if (cached := directories.get(zone, None)) is None:
+        return reload_directory(zone, irods_session)
+    loaded_at, entries = cached
+    if time.monotonic() - loaded_at > MANGO_USER_DIRECTORY_TTL:
+        refresh_in_background(zone)
+    return entries
+
+
+def get_entries(irods_session, ids) -> dict:
+    """{id: DirectoryEntry} for ids, ids that do not exist (anymore) are left out"""
+    entries = get_directory(irods_session)
+    if any(id not in entries for id in ids):
+        loaded_at, _ = directories[irods_session.zone]
+        if time.monotonic() - loaded_at > MANGO_USER_DIRECTORY_MIN_RELOAD:
+            entries = reload_directory(irods_session.zone, irods_session)
+    return {id: entries[id] for id in ids if id in entries}
+
+
+def get_groups(irods_session, name_prefix=""):
+    """DirectoryEntry of every group whose name starts with name_prefix, sorted on name"""
+    return sorted(
+        (
+            entry
+            for entry in get_directory(irods_session).values()
+            if entry.type == "rodsgroup" and entry.name.startswith(name_prefix)
+        ),
+        key=lambda entry: entry.name,
+    )
+
+
+def invalidate_directory(zone):
+    """Reload the directory of zone on its next use, after creating or removing users or groups"""
+    with directory_lock:
+        directories.pop(zone, None)
@@ -31,6 +31,7 @@ from wtforms import (
 
 from cache import cache
 from lib.util import collection_tree_to_dict
+from lib.streaming import render_view
 from pprint import pprint
 from irods.models import (
     Collection,
@@ -468,7 +469,7 @@ def catalog_search():
         )
         # pprint(pagination)
 
-        return render_template(
+        return render_view(
             "basic_catalog_search.html.j2",
             search_form=search_form,
             results=results,
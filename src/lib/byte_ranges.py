@@ -0,0 +1,194 @@
+import uuid
+import json
+import time
+import logging
+import datetime
+
+from flask import Response, request, stream_with_context
+from werkzeug.http import http_date
+
+from lib.parallel_download import (
+    MANGO_DOWNLOAD_STREAMS,
+    use_parallel_read,
+    read_parallel,
+)
+
+# HTTP range requests (RFC 9110) for data object downloads: a single range is answered
+# with 206 and Content-Range, several ranges with a multipart/byteranges body. Every range
+# seeks the iRODS file handle, so resuming a download or fetching segments in parallel
+# reads only the requested bytes. If-Range and If-None-Match are checked against the ETag.
+
+DOWNLOAD_CHUNK_SIZE = 2**24  # 16MiB
+# requests with more ranges get the complete content, as RFC 9110 allows
+MAX_RANGES = 32
+
+
+def utc_timestamp(catalog_time):
+    # PRC reports catalog times as naive datetimes in UTC
+    return int(catalog_time.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+
+def data_object_etag(data_object):
+    """Strong ETag: the checksum if there is one, else id, size and modify time"""
+    if data_object.checksum:
+        return data_object.checksum
+    return (
+        f"{data_object.id}-{data_object.size}-{utc_timestamp(data_object.modify_time)}"
+    )
+
+
+def satisfiable_ranges(byte_ranges, size):
+    """[(start, stop)] with stop exclusive, the ranges outside of the content dropped"""
+    ranges = []
+    for begin, end in byte_ranges.ranges:
+        if begin < 0:
+            # suffix range, the last -begin bytes
+            start, stop = max(0, size + begin), size
+        else:
+            start, stop = begin, min(size, end if end is not None else size)
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+
+def range_applies(etag, modify_time):
+    """False if If-Range names another version than the current one"""
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return utc_timestamp(modify_time) <= int(if_range.date.timestamp())
+    return True
+
+
+def read_sequential(f, start, stop, chunk_size):
+    f.seek(start)
+    position = start
+    while position < stop:
+        chunk = f.read(min(chunk_size, stop - position))
+        if not chunk:
+            break
+        position += len(chunk)
+        yield chunk
+
+
+def read_ranges(data_object, ranges, chunk_size):
+    """Generator of (range index, chunk) for every requested range, in order
+
+    Large ranges are read over several handles in parallel, the throughput is logged as
+    a json download_metrics line when the transfer ends (or the client goes away)
+    """
+    metrics = {
+        "path": data_object.path,
+        "ranges": len(ranges),
+        "bytes": 0,
+        "parallel_streams": 1,
+        "completed": False,
+    }
+    started = time.monotonic()
+    try:
+        with data_object.open("r") as f:
+            for index, (start, stop) in enumerate(ranges):
+                if use_parallel_read(start, stop):
+                    metrics["parallel_streams"] = MANGO_DOWNLOAD_STREAMS
+                    chunks = read_parallel(data_object, start, stop)
+                else:
+                    chunks = read_sequential(f, start, stop, chunk_size)
+                for chunk in chunks:
+                    metrics["bytes"] += len(chunk)
+                    yield index, chunk
+        metrics["completed"] = True
+    finally:
+        metrics["seconds"] = round(time.monotonic() - started, 3)
+        metrics["mib_per_second"] = round(
+            metrics["bytes"] / (1024 * 1024) / max(metrics["seconds"], 0.001), 1
+        )
+        logging.info(f"download_metrics {json.dumps(metrics)}")
+
+
+def data_object_response(
+    data_object, mimetype, headers=None, chunk_size=DOWNLOAD_CHUNK_SIZE
+):
+    """Streaming response for data_object honouring Range, If-Range and If-None-Match"""
+    size = data_object.size
+    etag = data_object_etag(data_object)
+    headers = {
+        **(headers or {}),
+        "Accept-Ranges": "bytes",
+        "Last-Modified": http_date(utc_timestamp(data_object.modify_time)),
+    }
+
+    if etag in request.if_none_match:
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+
+    ranges = None
+    if request.range is not None and request.range.units == "bytes":
+        if range_applies(etag, data_object.modify_time):
+            ranges = satisfiable_ranges(request.range, size)
+            if len(request.range.ranges) > MAX_RANGES:
+                ranges = None
+            elif not ranges:
+                response = Response(
+                    status=416, headers={**headers, "Content-Range": f"bytes */{size}"}
+                )
+                response.set_etag(etag)
+                return response
+
+    if not ranges:
+        response = Response(
+            stream_with_context(
+                chunk for _, chunk in read_ranges(data_object, [(0, size)], chunk_size)
+            ),
+            mimetype=mimetype,
+            direct_passthrough=True,
+            headers=headers,
+        )
+        response.content_length = size
+    elif len(ranges) == 1:
+        start, stop = ranges[0]
+        response = Response(
+            stream_with_context(
+                chunk for _, chunk in read_ranges(data_object, ranges, chunk_size)
+            ),
+            status=206,
+            mimetype=mimetype,
+            direct_passthrough=True,
+            headers={**headers, "Content-Range": f"bytes {start}-{stop - 1}/{size}"},
+        )
+        response.content_length = stop - start
+    else:
+        boundary = uuid.uuid4().hex
+        part_headers = [
+            (
+                f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+                f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+            ).encode()
+            for (start, stop) in ranges
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode()
+
+        def multipart():
+            current = None
+            for index, chunk in read_ranges(data_object, ranges, chunk_size):
+                if index != current:
+                    current = index
+                    yield part_headers[index]
+                yield chunk
+            yield closing
+
+        response = Response(
+            stream_with_context(multipart()),
+            status=206,
+            content_type=f"multipart/byteranges; boundary={boundary}",
+            direct_passthrough=True,
+            headers=headers,
+        )
+        response.content_length = (
+            sum(len(part) for part in part_headers)
+            + sum(stop - start for (start, stop) in ranges)
+            + len(closing)
+        )
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,22 @@
+import gzip
+from flask import request, Response
+
+# smaller bodies are not worth the compression overhead
+MIN_COMPRESS_SIZE = 1024
+
+
+def gzip_response(response: Response) -> Response:
+    """Compresses a (non streamed) response body if the client accepts gzip"""
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or "gzip" not in request.accept_encodings
+        or response.content_length is None
+        or response.content_length < MIN_COMPRESS_SIZE
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
@@ -0,0 +1,56 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from flask import current_app, g
+
+# Independent catalog lookups of a view can run concurrently, every PRC call takes its own
+# connection from the session connection pool. Opt-in via MANGO_PARALLEL_LOOKUPS=enabled
+MANGO_PARALLEL_LOOKUPS = (
+    os.environ.get("MANGO_PARALLEL_LOOKUPS", "disabled").lower() == "enabled"
+)
+MANGO_PARALLEL_LOOKUP_THREADS = int(os.environ.get("MANGO_PARALLEL_LOOKUP_THREADS", 32))
+# seconds, per lookup, counting from the moment the lookups are submitted
+MANGO_PARALLEL_LOOKUP_TIMEOUT = float(
+    os.environ.get("MANGO_PARALLEL_LOOKUP_TIMEOUT", 60)
+)
+
+lookup_executor = ThreadPoolExecutor(
+    max_workers=MANGO_PARALLEL_LOOKUP_THREADS, thread_name_prefix="mango-lookup"
+)
+
+
+def run_lookups(lookups: dict, timeout=MANGO_PARALLEL_LOOKUP_TIMEOUT) -> dict:
+    """Runs a dict of independent callables and returns their results under the same keys
+
+    In parallel mode every callable runs in a worker thread with an app context holding a
+    copy of the request g (irods_session, tracer, ...). A lookup that is not done within
+    timeout seconds raises concurrent.futures.TimeoutError, as does any exception of a
+    lookup propagate to the caller.
+    """
+    if not MANGO_PARALLEL_LOOKUPS:
+        return {key: lookup() for (key, lookup) in lookups.items()}
+
+    app = current_app._get_current_object()
+    g_values = dict(g.__dict__)
+
+    def run_with_context(lookup):
+        with app.app_context():
+            g.__dict__.update(g_values)
+            return lookup()
+
+    deadline = time.monotonic() + timeout
+    futures = {
+        key: lookup_executor.submit(run_with_context, lookup)
+        for (key, lookup) in lookups.items()
+    }
+    results = {}
+    try:
+        for key, future in futures.items():
+            results[key] = future.result(timeout=max(0, deadline - time.monotonic()))
+    except TimeoutError:
+        logging.warning(f"Lookup {key} did not finish within {timeout} seconds")
+        for future in futures.values():
+            future.cancel()
+        raise
+    return results
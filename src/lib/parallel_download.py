@@ -0,0 +1,94 @@
+import os
+import threading
+
+# Parallel reads of large data objects: one PRC file handle (and so one connection) moves
+# a chunk per round trip, several handles reading disjoint chunks concurrently get a
+# multiple of that throughput. Workers claim chunks in ascending order, a chunk can only be
+# claimed with a free slot in the reorder buffer, so at most MANGO_DOWNLOAD_BUFFER_CHUNKS
+# chunks are in memory and the chunk the client needs next is always being read or ready.
+
+# parallel handles per download, 1 disables parallel reads
+MANGO_DOWNLOAD_STREAMS = int(os.environ.get("MANGO_DOWNLOAD_STREAMS", 4))
+# ranges of at least this many bytes are read in parallel
+MANGO_PARALLEL_DOWNLOAD_THRESHOLD = int(
+    os.environ.get("MANGO_PARALLEL_DOWNLOAD_THRESHOLD", 256 * 1024 * 1024)
+)
+MANGO_DOWNLOAD_PARALLEL_CHUNK_SIZE = int(
+    os.environ.get("MANGO_DOWNLOAD_PARALLEL_CHUNK_SIZE", 8 * 1024 * 1024)
+)
+# memory bound per download: buffer chunks x chunk size
+MANGO_DOWNLOAD_BUFFER_CHUNKS = int(
+    os.environ.get("MANGO_DOWNLOAD_BUFFER_CHUNKS", 2 * MANGO_DOWNLOAD_STREAMS)
+)
+
+
+def use_parallel_read(start, stop):
+    return (
+        MANGO_DOWNLOAD_STREAMS > 1 and stop - start >= MANGO_PARALLEL_DOWNLOAD_THRESHOLD
+    )
+
+
+def read_parallel(
+    data_object,
+    start,
+    stop,
+    streams=MANGO_DOWNLOAD_STREAMS,
+    chunk_size=MANGO_DOWNLOAD_PARALLEL_CHUNK_SIZE,
+    buffer_chunks=MANGO_DOWNLOAD_BUFFER_CHUNKS,
+):
+    """Generator of the chunks of data_object from start up to stop, in order
+
+    The chunks are read by streams handles in parallel, each on its own connection
+    """
+    chunk_count = (stop - start + chunk_size - 1) // chunk_size
+    buffer_slots = threading.Semaphore(max(streams, buffer_chunks))
+    condition = threading.Condition()
+    ready = {}
+    state = {"next_claim": 0, "error": None}
+    cancelled = threading.Event()
+
+    def worker():
+        try:
+            with data_object.open("r") as f:
+                while True:
+                    buffer_slots.acquire()
+                    with condition:
+                        index = state["next_claim"]
+                        if cancelled.is_set() or index >= chunk_count:
+                            buffer_slots.release()
+                            return
+                        state["next_claim"] += 1
+                    offset = start + index * chunk_size
+                    f.seek(offset)
+                    chunk = f.read(min(chunk_size, stop - offset))
+                    with condition:
+                        ready[index] = chunk
+                        condition.notify_all()
+        except Exception as e:
+            with condition:
+                state["error"] = e
+                condition.notify_all()
+
+    workers = [
+        threading.Thread(target=worker, name=f"mango-download-{n}", daemon=True)
+        for n in range(min(streams, chunk_count))
+    ]
+    for thread in workers:
+        thread.start()
+    try:
+        for index in range(chunk_count):
+            with condition:
+                condition.wait_for(lambda: index in ready or state["error"])
+                if index not in ready:
+                    raise state["error"]
+                chunk = ready.pop(index)
+            buffer_slots.release()
+            if not chunk:
+                # the data object is shorter than the catalog says
+                break
+            yield chunk
+    finally:
+        # client gone or done: stop claiming and unblock the waiting workers
+        cancelled.set()
+        for _ in workers:
+            buffer_slots.release()
@@ -0,0 +1,41 @@
+import os
+from flask import render_template, stream_template, get_flashed_messages
+
+# Streamed rendering: the page is sent while the template is being rendered, so the
+# browser starts painting right away and the html of a large listing is never held in
+# memory as a whole. Opt-in via MANGO_STREAM_TEMPLATES=enabled. Once the first chunk is
+# sent the status is fixed, an error halfway can only cut the page short.
+MANGO_STREAM_TEMPLATES = (
+    os.environ.get("MANGO_STREAM_TEMPLATES", "disabled").lower() == "enabled"
+)
+# jinja yields every text fragment separately, collect them into chunks of this size
+MANGO_STREAM_CHUNK_SIZE = int(os.environ.get("MANGO_STREAM_CHUNK_SIZE", 16 * 1024))
+
+
+def buffered(fragments, chunk_size=MANGO_STREAM_CHUNK_SIZE):
+    chunk = []
+    length = 0
+    for fragment in fragments:
+        chunk.append(fragment)
+        length += len(fragment)
+        if length >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+            length = 0
+    if chunk:
+        yield "".join(chunk)
+
+
+def render_view(template_name_or_list, **context):
+    """render_template, or a streamed response in streaming mode
+
+    In streaming mode, context values may be generators (rows fetched from the catalog
+    while rendering), the request context and the irods session stay available until the
+    last chunk is sent.
+    """
+    if not MANGO_STREAM_TEMPLATES:
+        return render_template(template_name_or_list, **context)
+    # the session cookie is written before the body is generated: pop the flashed
+    # messages now, get_flashed_messages in the template gets them from the request
+    get_flashed_messages()
+    return buffered(stream_template(template_name_or_list, **context))
@@ -0,0 +1,274 @@
+import os
+import zipfile
+import tarfile
+import hashlib
+import logging
+import datetime
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Response, stream_with_context
+
+from lib.byte_ranges import utc_timestamp
+
+# Archives of data objects generated while they are sent: every entry is read from its own
+# iRODS handle chunk by chunk and its bytes go straight into the response, so there is no
+# staging on local disk, memory stays at about one chunk and the first byte leaves at once.
+# tar (pax headers, no size limits) gets an exact Content-Length as the catalog sizes are
+# known up front, zip is zip64 with data descriptors as the CRC is only known afterwards.
+#
+# Archives of many small objects are dominated by a round trip per object, so the upcoming
+# objects up to one chunk are read ahead on a few workers while the current entry streams,
+# at most MANGO_ARCHIVE_PREFETCH_ENTRIES of them are held in memory. A sha256sum style
+# manifest of the bytes as sent can close the archive.
+
+ARCHIVE_CHUNK_SIZE = 4 * 1024 * 1024
+MANGO_ARCHIVE_PREFETCH_WORKERS = int(
+    os.environ.get("MANGO_ARCHIVE_PREFETCH_WORKERS", 4)
+)
+MANGO_ARCHIVE_PREFETCH_ENTRIES = int(
+    os.environ.get("MANGO_ARCHIVE_PREFETCH_ENTRIES", 8)
+)
+MANIFEST_NAME = "manifest-sha256.txt"
+ARCHIVE_FORMATS = {"tar": "application/x-tar", "zip": "application/zip"}
+
+# chunks: callable returning an iterator over the content
+ArchiveEntry = namedtuple("ArchiveEntry", ["name", "size", "modify_time", "chunks"])
+
+
+def data_object_chunks(irods_session, data_object_path, chunk_size=ARCHIVE_CHUNK_SIZE):
+    with irods_session.data_objects.open(data_object_path, "r") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+class Prefetcher:
+    """Reads the content of the small entries ahead, in archive order
+
+    entries holds the same entries with the chunks of the small ones served from the
+    read ahead content, close() stops reading ahead
+    """
+
+    def __init__(
+        self,
+        entries,
+        workers=MANGO_ARCHIVE_PREFETCH_WORKERS,
+        window=MANGO_ARCHIVE_PREFETCH_ENTRIES,
+    ):
+        self.original_entries = entries
+        self.small = [
+            index
+            for (index, entry) in enumerate(entries)
+            if entry.size <= ARCHIVE_CHUNK_SIZE
+        ]
+        self.next_small = 0
+        self.window = window
+        self.futures = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="mango-archive"
+        )
+        self.entries = [
+            (
+                entry._replace(chunks=lambda index=index: self.chunks(index))
+                if entry.size <= ARCHIVE_CHUNK_SIZE
+                else entry
+            )
+            for (index, entry) in enumerate(entries)
+        ]
+
+    def read(self, index):
+        return b"".join(self.original_entries[index].chunks())
+
+    def fill(self):
+        while self.next_small < len(self.small) and len(self.futures) < self.window:
+            index = self.small[self.next_small]
+            self.futures[index] = self.executor.submit(self.read, index)
+            self.next_small += 1
+
+    def chunks(self, index):
+        self.fill()
+        content = self.futures.pop(index).result()
+        # the freed slot goes to the next small entry right away
+        self.fill()
+        if content:
+            yield content
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def with_manifest(entries, directory):
+    """The entries plus a manifest of their sha256 digests at <directory>/MANIFEST_NAME
+
+    The digests are taken from the chunks as they are written into the archive, names
+    relative to directory
+    """
+    digests = {}
+
+    def digested(entry):
+        digest = digests[entry.name] = hashlib.sha256()
+        for chunk in entry.chunks():
+            digest.update(chunk)
+            yield chunk
+
+    def manifest_lines():
+        for entry in entries:
+            name = entry.name[len(directory) + 1 :]
+            yield f"{digests[entry.name].hexdigest()}  {name}\n".encode()
+
+    manifest_size = sum(
+        len(f"{'0' * 64}  {entry.name[len(directory) + 1 :]}\n".encode())
+        for entry in entries
+    )
+    return [
+        entry._replace(chunks=lambda entry=entry: digested(entry)) for entry in entries
+    ] + [
+        ArchiveEntry(
+            f"{directory}/{MANIFEST_NAME}",
+            manifest_size,
+            datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None),
+            manifest_lines,
+        )
+    ]
+
+
+def sized_chunks(entry):
+    """The chunks of entry cut or zero padded to its catalog size, headers announce it"""
+    written = 0
+    for chunk in entry.chunks():
+        chunk = chunk[: entry.size - written]
+        written += len(chunk)
+        if chunk:
+            yield chunk
+    if written < entry.size:
+        logging.warning(
+            f"{entry.name} is {written} bytes instead of {entry.size}, padded with zeros"
+        )
+    while written < entry.size:
+        padding = min(ARCHIVE_CHUNK_SIZE, entry.size - written)
+        written += padding
+        yield bytes(padding)
+
+
+def tar_header(entry):
+    tar_info = tarfile.TarInfo(entry.name)
+    tar_info.size = entry.size
+    tar_info.mtime = utc_timestamp(entry.modify_time)
+    tar_info.mode = 0o644
+    return tar_info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def tar_padding(size):
+    return bytes(-size % tarfile.BLOCKSIZE)
+
+
+def tar_trailer(archive_size):
+    # two zero blocks, then zeros up to a complete record, as tarfile closes archives
+    end_of_archive = archive_size + 2 * tarfile.BLOCKSIZE
+    return bytes(2 * tarfile.BLOCKSIZE + (-end_of_archive % tarfile.RECORDSIZE))
+
+
+def tar_archive_size(headers, entries):
+    size = sum(
+        len(header) + entry.size + len(tar_padding(entry.size))
+        for header, entry in zip(headers, entries)
+    )
+    return size + len(tar_trailer(size))
+
+
+def stream_tar(entries, headers):
+    archive_size = 0
+    for header, entry in zip(headers, entries):
+        yield header
+        yield from sized_chunks(entry)
+        yield tar_padding(entry.size)
+        archive_size += len(header) + entry.size + len(tar_padding(entry.size))
+    yield tar_trailer(archive_size)
+
+
+class ResponseSink:
+    """Write-only file object for zipfile, the written bytes are taken by drain()"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = (self.chunks, [])
+        return chunks
+
+
+def zip_date_time(modify_time):
+    # zip dates start in 1980
+    modify_time = max(modify_time, datetime.datetime(1980, 1, 1))
+    return modify_time.timetuple()[:6]
+
+
+def stream_zip(entries):
+    sink = ResponseSink()
+    # the sink cannot seek, so zipfile writes data descriptors after the entries
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        for entry in entries:
+            zip_info = zipfile.ZipInfo(entry.name, zip_date_time(entry.modify_time))
+            zip_info.external_attr = 0o644 << 16
+            with archive.open(zip_info, "w", force_zip64=True) as f:
+                for chunk in entry.chunks():
+                    f.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+def closing(stream, prefetcher):
+    try:
+        yield from stream
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+
+
+def archive_response(
+    entries, archive_name, archive_format="tar", prefetch=True, manifest=False
+):
+    """Streaming response with the entries as <archive_name>.<archive_format>
+
+    With manifest, the entries need to be in the directory <archive_name>
+    """
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unsupported archive format {archive_format}")
+    prefetcher = Prefetcher(entries) if prefetch else None
+    if prefetcher is not None:
+        entries = prefetcher.entries
+    if archive_format == "tar":
+        # tar entries hold exactly their catalog size, the manifest digests those bytes
+        entries = [
+            entry._replace(chunks=lambda entry=entry: sized_chunks(entry))
+            for entry in entries
+        ]
+    if manifest:
+        entries = with_manifest(entries, archive_name)
+    headers = {
+        "Content-Disposition": f"attachment; filename={archive_name}.{archive_format}"
+    }
+    if archive_format == "zip":
+        return Response(
+            stream_with_context(closing(stream_zip(entries), prefetcher)),
+            mimetype=ARCHIVE_FORMATS["zip"],
+            direct_passthrough=True,
+            headers=headers,
+        )
+    tar_headers = [tar_header(entry) for entry in entries]
+    response = Response(
+        stream_with_context(closing(stream_tar(entries, tar_headers), prefetcher)),
+        mimetype=ARCHIVE_FORMATS["tar"],
+        direct_passthrough=True,
+        headers=headers,
+    )
+    response.content_length = tar_archive_size(tar_headers, entries)
+    return response
@@ -1,7 +1,11 @@
 import os
+from collections import namedtuple
 from irods.collection import iRODSCollection
 from irods.data_object import iRODSDataObject
 from irods.session import iRODSSession
+from irods.query import Query
+from irods.column import In, Like
+from irods.models import Collection, DataObject
 import base64
 
 
@@ -16,15 +20,12 @@ def generate_breadcrumbs(path_string: str):
 
 
 def collection_tree_to_dict(collection: iRODSCollection, level=0):
-    (_, label) = os.path.split(collection.path)
-    d = {"id": collection.path, "label": label}
-    if collection.subcollections and level < 3 and len(collection.subcollections) < 100:
-        level += 1
-        d["children"] = [
-            collection_tree_to_dict(subcollection, level)
-            for subcollection in collection.subcollections
-        ]
-    return d
+    # one GenQuery for the whole tree instead of one per node
+    from kernel.common.listing import list_collection_tree, tree_to_treeselect
+
+    return tree_to_treeselect(
+        list_collection_tree(collection.manager.sess, collection.path, depth=3 - level)
+    )
 
 
 def strip_suffix(_string: str, _suffix: str):
@@ -101,7 +102,10 @@ def get_collection_size(collection: iRODSCollection):
 
 
 def current_user_is_naked_owner(irods_session: iRODSSession, catalog_item):
-    permissions = irods_session.permissions.get(catalog_item, report_raw_acls=True)
+    # imported late, kernel modules import lib.util
+    from kernel.common.acl_cache import get_acls
+
+    permissions = get_acls(irods_session, catalog_item)
     for permission in permissions:
         if (
             irods_session.username == permission.user_name
@@ -133,12 +137,124 @@ def execute_atomic_operations(
         mimic_atomic_operations(catalog_item, avu_operations)
 
 
-def get_type_for_path(irods_session: iRODSSession, item_path: str):
-    try:
-        _ = irods_session.collections.get(item_path)
-        return "collection"
-    except Exception:
-        return "data_object"
+ResolvedPath = namedtuple(
+    "ResolvedPath", ["path", "type", "id", "size", "owner_name", "modify_time"]
+)
+# paths per In() condition, keeps the GenQuery condition string within bounds
+RESOLVE_BATCH_SIZE = 50
+
+
+def resolve_paths(irods_session: iRODSSession, paths) -> dict:
+    """Classifies catalog paths as collection or data object without probing each one
+
+    Returns a ResolvedPath per existing path (size is None for collections), paths that
+    do not exist or are not accessible are left out. Every batch of RESOLVE_BATCH_SIZE
+    paths takes one GenQuery for the collections and one for the data objects.
+    """
+    paths = list(dict.fromkeys(str(path).rstrip("/") or "/" for path in paths))
+    resolved = {}
+    for start in range(0, len(paths), RESOLVE_BATCH_SIZE):
+        batch = paths[start : start + RESOLVE_BATCH_SIZE]
+        for row in Query(
+            irods_session,
+            Collection.id,
+            Collection.name,
+            Collection.owner_name,
+            Collection.modify_time,
+        ).filter(In(Collection.name, batch)):
+            resolved[row[Collection.name]] = ResolvedPath(
+                path=row[Collection.name],
+                type="collection",
+                id=row[Collection.id],
+                size=None,
+                owner_name=row[Collection.owner_name],
+                modify_time=row[Collection.modify_time],
+            )
+        candidates = [
+            os.path.split(path)
+            for path in batch
+            if path not in resolved and path != "/"
+        ]
+        if not candidates:
+            continue
+        # parents x names may match more than asked for, filtered on the exact path
+        for row in Query(
+            irods_session,
+            DataObject.id,
+            DataObject.name,
+            Collection.name,
+            DataObject.owner_name,
+            DataObject.size,
+            DataObject.modify_time,
+        ).filter(
+            In(Collection.name, list(set(parent for (parent, _) in candidates))),
+            In(DataObject.name, list(set(name for (_, name) in candidates))),
+        ):
+            path = f"{row[Collection.name].rstrip('/')}/{row[DataObject.name]}"
+            if path not in batch:
+                continue
+            # one row per replica, the most recently modified one counts
+            if (previous := resolved.get(path)) and previous.modify_time >= row[
+                DataObject.modify_time
+            ]:
+                continue
+            resolved[path] = ResolvedPath(
+                path=path,
+                type="data_object",
+                id=row[DataObject.id],
+                size=row[DataObject.size],
+                owner_name=row[DataObject.owner_name],
+                modify_time=row[DataObject.modify_time],
+            )
+    return resolved
+
+
+def resolve_subtree_data_objects(irods_session: iRODSSession, collection_path) -> list:
+    """ResolvedPath of every data object below the collection, at any depth, by path
+
+    One GenQuery for the complete subtree
+    """
+    collection_path = str(collection_path).rstrip("/")
+    resolved = {}
+    for row in Query(
+        irods_session,
+        DataObject.id,
+        DataObject.name,
+        Collection.name,
+        DataObject.owner_name,
+        DataObject.size,
+        DataObject.modify_time,
+    ).filter(Like(Collection.name, f"{collection_path}%")):
+        # the pattern also matches siblings such as <collection_path>-old
+        if row[Collection.name] != collection_path and not row[
+            Collection.name
+        ].startswith(f"{collection_path}/"):
+            continue
+        path = f"{row[Collection.name]}/{row[DataObject.name]}"
+        # one row per replica, the most recently modified one counts
+        if (previous := resolved.get(path)) and previous.modify_time >= row[
+            DataObject.modify_time
+        ]:
+            continue
+        resolved[path] = ResolvedPath(
+            path=path,
+            type="data_object",
+            id=row[DataObject.id],
+            size=row[DataObject.size],
+            owner_name=row[DataObject.owner_name],
+            modify_time=row[DataObject.modify_time],
+        )
+    return [resolved[path] for path in sorted(resolved)]
+
+
+def get_type_for_path(
+    irods_session: iRODSSession, item_path: str, default="data_object"
+):
+    """collection or data_object, default when the path does not resolve"""
+    resolved = resolve_paths(irods_session, [item_path]).get(
+        str(item_path).rstrip("/") or "/"
+    )
+    return resolved.type if resolved else default
 
 
 # equivalents to javascript btoa and atob
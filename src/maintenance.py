@@ -0,0 +1,58 @@
+# Maintenance mode: as long as the file storage/service-down.txt exists, every view
+# answers 503 with the content of that file as message. The file lives on the shared
+# storage volume so it can be toggled for all nodes at once, but is only looked at
+# every MANGO_MAINTENANCE_CHECK_INTERVAL seconds instead of on every request.
+
+import os
+import time
+import logging
+from pathlib import Path
+
+MAINTENANCE_FILE = Path("storage/service-down.txt")
+MAINTENANCE_CHECK_INTERVAL = float(
+    os.environ.get("MANGO_MAINTENANCE_CHECK_INTERVAL", 10)
+)
+
+
+class MaintenanceMode:
+    def __init__(self, path: Path = MAINTENANCE_FILE, check_interval=MAINTENANCE_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.checked_at = None
+        self.message = None
+
+    def refresh(self):
+        try:
+            self.message = self.path.read_text()
+        except FileNotFoundError:
+            self.message = None
+        except OSError as e:
+            # network storage hiccup, keep the last known state until the next check
+            logging.warning(f"Could not read {self.path}: {e}")
+        self.checked_at = time.monotonic()
+
+    def get_message(self):
+        """Returns the maintenance message, or None if the service is up"""
+        if (
+            self.checked_at is None
+            or time.monotonic() - self.checked_at > self.check_interval
+        ):
+            self.refresh()
+        return self.message
+
+    def is_active(self):
+        return self.get_message() is not None
+
+    def enable(self, message=""):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(message)
+        logging.warning(f"Maintenance mode enabled: {message}")
+        self.refresh()
+
+    def disable(self):
+        self.path.unlink(missing_ok=True)
+        logging.warning("Maintenance mode disabled")
+        self.refresh()
+
+
+maintenance_mode = MaintenanceMode()
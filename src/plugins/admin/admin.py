@@ -14,6 +14,8 @@ from flask import (
 )
 from mango_ui import register_module_admin
 import irods_session_pool
+from maintenance import maintenance_mode
+from plugins.admin import require_mango_portal_admin
 
 admin_admin_bp = Blueprint(
     "admin_admin_bp", __name__, template_folder="templates/admin"
@@ -39,7 +41,8 @@ def node_sessions():
     """ """
     return render_template(
         "node_sessions.html.j2",
-        user_sessions=irods_session_pool.irods_user_sessions,
+        # a copy, the cleanup thread removes expired sessions in place
+        user_sessions=dict(irods_session_pool.irods_user_sessions),
         cleanup_start=irods_session_pool.cleanup_old_sessions_thread.start_time,
     )
 
@@ -51,3 +54,25 @@ def node_logins():
         "node_logins.html.j2",
         logins_since_server_start=irods_session_pool.irods_node_logins,
     )
+
+
+@admin_admin_bp.route("/admin/maintenance")
+def maintenance():
+    return render_template(
+        "maintenance.html.j2",
+        maintenance_message=maintenance_mode.get_message(),
+        check_interval=maintenance_mode.check_interval,
+    )
+
+
+@admin_admin_bp.route("/admin/maintenance", methods=["POST"])
+@require_mango_portal_admin
+def set_maintenance():
+    if "enable" in request.form:
+        maintenance_mode.enable(request.form.get("message", ""))
+        flash("Maintenance mode enabled for all nodes", "warning")
+    else:
+        maintenance_mode.disable()
+        flash("Maintenance mode disabled", "success")
+
+    return redirect(url_for("admin_admin_bp.maintenance"))
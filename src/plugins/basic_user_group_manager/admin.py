@@ -3,6 +3,8 @@ from irods.user import iRODSGroup
 from irods.models import Group, User
 from irods.session import iRODSSession
 from mango_ui import register_module
+import irods_session_pool
+from kernel.common import user_directory
 
 basic_user_group_manager_admin_bp = Blueprint(
     "basic_user_group_manager_admin_bp", __name__, template_folder="templates"
@@ -34,10 +36,7 @@ def current_user_can_manage(irods_session: iRODSSession):
 def user_group_manager_index():
 
     operator_session: iRODSSession = g.irods_session
-    groups = [
-        iRODSGroup(operator_session.groups, item)
-        for item in operator_session.query(Group).filter(User.type == "rodsgroup").all()
-    ]
+    groups = user_directory.get_groups(operator_session)
 
     editable = current_user_can_manage(operator_session)
 
@@ -87,6 +86,7 @@ def add_group():
     group_name = request.form["group_name"].strip()
     try:
         new_group: iRODSGroup = operator_session.groups.create(group_name)
+        user_directory.invalidate_directory(g.irods_session.zone)
         return redirect(
             url_for(
                 "basic_user_group_manager_admin_bp.view_members",
@@ -110,6 +110,8 @@ def remove_group():
         operator_session.groups.remove(group_name)
     except Exception as e:
         flash(f"Failed to remove group: {e}", "danger")
+    irods_session_pool.invalidate_user_groups(g.irods_session.zone)
+    user_directory.invalidate_directory(g.irods_session.zone)
     if "redirect_route" in request.values:
         return redirect(request.values["redirect_route"])
     if "redirect_hash" in request.values:
@@ -131,6 +133,8 @@ def add_members(group):
             operator_session.groups.addmember(group, member)
     except Exception as e:
         flash(f"Failed to add members {members} to group {group}: {e}", "danger")
+    for member in members:
+        irods_session_pool.invalidate_user_groups(g.irods_session.zone, member)
     return redirect(request.referrer)
 
 
@@ -146,6 +150,8 @@ def remove_members(group):
             operator_session.groups.removemember(group, member)
     except Exception as e:
         flash(f"Failed to add members {members} to group {group}: {e}", "danger")
+    for member in members:
+        irods_session_pool.invalidate_user_groups(g.irods_session.zone, member)
     return redirect(request.referrer)
 
 
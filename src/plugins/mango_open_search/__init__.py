@@ -10,6 +10,7 @@ import irods_zones_config
 from threading import Lock, Thread, Event
 import datetime, time, logging
 from lib import util
+from kernel.common.acl_cache import query_acls
 import signals
 from flask import current_app
 import multidict
@@ -228,12 +229,21 @@ def get_path_id(irods_session: iRODSSession, path: str):
     """
     global path_ids
     if not path in path_ids:
+        cache_path_ids(irods_session, [path])
+    return path_ids.get(path, False)
+
+
+def cache_path_ids(irods_session: iRODSSession, paths):
+    """Looks up the ids of all uncached collection paths in one batch"""
+    if missing_paths := [path for path in paths if path not in path_ids]:
         try:
-            collection: iRODSCollection = irods_session.collections.get(path)
-            path_ids[path] = collection.id
-        except Exception:
-            return False
-    return path_ids[path]
+            resolved_paths = util.resolve_paths(irods_session, missing_paths)
+        except Exception as e:
+            logging.info(f"Could not resolve paths {missing_paths}: {e}")
+            return
+        for path, resolved in resolved_paths.items():
+            if resolved.type == "collection":
+                path_ids[path] = resolved.id
 
 
 def get_open_search_doc_id(
@@ -343,11 +353,9 @@ def get_basic_index_doc_for_item(
     fields["irods_item_type_simple"] = "c" if isinstance(item, iRODSCollection) else "d"
     if isinstance(item, iRODSDataObject):
         fields["size"] = item.size
-    # To be changed with PRC release >= 1.1.6
+    # user and group types come from the zone user directory
     acl_users = []
-    _permissions = irods_session.acls.get(
-        item, acl_users=acl_users
-    )
+    _permissions = query_acls(irods_session, item, acl_users=acl_users)
     acl_read_users = []
     acl_read_groups = []
 
@@ -382,6 +390,14 @@ def get_basic_index_doc_for_item(
     # print(f"{parent_collection_path_elements}")
     fields["irods_parent_path"] = parent_collection_path
 
+    # all ancestors at once instead of a catalog lookup per level
+    cache_path_ids(
+        irods_session,
+        [
+            "/" + "/".join(parent_collection_path_elements[:level])
+            for level in range(1, len(parent_collection_path_elements) + 1)
+        ],
+    )
     for path_element in reversed(parent_collection_path_elements.copy()):
         # print(f"Path element: {path_element}")
         if path_element and (
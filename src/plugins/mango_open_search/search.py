@@ -13,6 +13,7 @@ from flask import (
     flash,
 )
 
+from lib.streaming import render_view
 from . import (
     add_index_job,
     get_open_search_client,
@@ -126,6 +127,6 @@ def zone_search():
         )
 
     view_template = "mango_open_search/search_results.html.j2"
-    return render_template(
+    return render_view(
         view_template, search_results=search_results, search_string=search_string
     )
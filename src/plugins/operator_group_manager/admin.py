@@ -7,6 +7,8 @@ from irods.session import iRODSSession
 from cache import cache
 import re, logging
 from mango_ui import register_module
+import irods_session_pool
+from kernel.common import user_directory
 
 operator_group_manager_admin_bp = Blueprint(
     "operator_group_manager_admin_bp", __name__, template_folder="templates"
@@ -53,13 +55,7 @@ def group_manager_index(realm: str):
     operator_session = get_operator_session(g.irods_session.zone)
     if realm:
         # operator_session.
-        groups = [
-            iRODSGroup(operator_session.groups, item)
-            for item in operator_session.query(Group)
-            .filter(Like(Group.name, f"{realm}%"))
-            .filter(User.type == "rodsgroup")
-            .all()
-        ]
+        groups = user_directory.get_groups(operator_session, name_prefix=realm)
 
     if not realm:
         if "mango_admin" in g.irods_session.my_group_names:
@@ -170,6 +166,7 @@ def add_group(realm):
     try:
         new_group : iRODSGroup = operator_session.user_groups.create(group_name)
         new_group.metadata.add('mg.realm', realm)
+        user_directory.invalidate_directory(g.irods_session.zone)
         return redirect(
             url_for(
                 "operator_group_manager_admin_bp.view_members",
@@ -194,6 +191,8 @@ def remove_group(realm):
         operator_session.groups.remove(group_name)
     except Exception as e:
         flash(f"Failed to remove group: {e}", "danger")
+    irods_session_pool.invalidate_user_groups(g.irods_session.zone)
+    user_directory.invalidate_directory(g.irods_session.zone)
     if "redirect_route" in request.values:
         return redirect(request.values["redirect_route"])
     if "redirect_hash" in request.values:
@@ -215,6 +214,8 @@ def add_members(realm, group):
             operator_session.groups.addmember(group, member)
     except Exception as e:
         flash(f"Failed to add members {members} to group {group}: {e}", "danger")
+    for member in members:
+        irods_session_pool.invalidate_user_groups(g.irods_session.zone, member)
     return redirect(request.referrer)
 
 
@@ -230,6 +231,8 @@ def remove_members(realm, group):
             operator_session.groups.removemember(group, member)
     except Exception as e:
         flash(f"Failed to add members {members} to group {group}: {e}", "danger")
+    for member in members:
+        irods_session_pool.invalidate_user_groups(g.irods_session.zone, member)
     return redirect(request.referrer)
 
 @operator_group_manager_admin_bp.route('/operator_group_manager/set/realm/<realm>/<group>', methods=['POST'])
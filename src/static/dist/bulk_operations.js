@@ -26,7 +26,7 @@ select_all.addEventListener('change', () => {
         // When this checkbox is checked
         tbody_checkboxes.forEach((el) => el.checked = true); // all other checkboxes are checked
         bulk_buttons.querySelectorAll("button").forEach((button) => {
-            if (are_dobj_selected() || ["bulk-delete", "bulk-move"].indexOf(button.id) > -1) {
+            if (are_dobj_selected() || ["bulk-delete", "bulk-move", "bulk-download"].indexOf(button.id) > -1) {
                 button.removeAttribute("disabled")
             }
         })
@@ -54,7 +54,7 @@ tbody_checkboxes.forEach((checkbox) => {
         if (checkbox.checked) {
             // when the checkbox is checked
             bulk_buttons.querySelectorAll("button").forEach((button) => {
-                if (are_dobj_selected() || ["bulk-delete", "bulk-move"].indexOf(button.id) > -1) {
+                if (are_dobj_selected() || ["bulk-delete", "bulk-move", "bulk-download"].indexOf(button.id) > -1) {
                     button.removeAttribute("disabled")
                 }
             })
@@ -69,7 +69,7 @@ tbody_checkboxes.forEach((checkbox) => {
             // when the checkbox is unchecked
             select_all.checked = false; // make sure that the header checkbox is unchecked
             bulk_buttons.querySelectorAll("button").forEach((button) => {
-                if (are_checked == 0 || (!are_dobj_selected() && ["bulk-copy", "bulk-download"].indexOf(button.id) > -1)) {
+                if (are_checked == 0 || (!are_dobj_selected() && ["bulk-copy"].indexOf(button.id) > -1)) {
                     button.setAttribute("disabled", "")
                 }
             })
@@ -131,6 +131,13 @@ function apply_bulk_operation(action) {
     /** Text to return in the confirmation dialog */
     const confirmation_text = confirmation_form.querySelector('p#confirmation-text')
 
+    confirmation_form.onsubmit = (event) => {
+        // move, copy and delete run as background jobs, the browser follows their progress
+        if (confirmation_form.dataset.bulkJobs == 'enabled' && confirmation_form.querySelector('input#action').value != 'download') {
+            event.preventDefault();
+            submit_bulk_job(confirmation_form);
+        }
+    };
     confirmation_form.addEventListener("submit", ()=> { 
         modal.hide();
         tbody_checkboxes.forEach((el) => el.checked = false); // uncheck all checkboxes
@@ -163,6 +170,11 @@ btn.setAttribute('disabled', ''); // the button to trigger the action is disable
     });
     /** Checkbox to force delete items. */
     const del_checkbox = confirmation_form.querySelector('div.form-check#force-checkbox');
+    /** Archive format choice for downloads. */
+    const format_select = confirmation_form.querySelector('select#archive-format');
+    if (format_select != undefined && action != 'download') {
+        format_select.remove();
+    }
 
 
     // ACT
@@ -194,7 +206,19 @@ btn.setAttribute('disabled', ''); // the button to trigger the action is disable
             del_checkbox.remove();
         }
         confirmation_form.querySelector('input#destination').value = "";
-        confirmation_modal.querySelector('p#confirmation-text').innerHTML = `${n_dobjects_printed} will be downloaded.`;
+        confirmation_modal.querySelector('p#confirmation-text').innerHTML = `${n_items} will be downloaded.`;
+        if (format_select == undefined) {
+            // the archive is streamed as tar or zip
+            const format_select = Field.quick('select', 'form-select mb-2');
+            format_select.id = 'archive-format';
+            format_select.name = 'archive_format';
+            for (const format of ['tar', 'zip']) {
+                const option = Field.quick('option', '', format);
+                option.value = format;
+                format_select.appendChild(option);
+            }
+            confirmation_form.querySelector('div.modal-body').insertBefore(format_select, confirmation_text);
+        }
         modal.show() // show confirmation modal
 
     } else {
@@ -223,6 +247,51 @@ btn.setAttribute('disabled', ''); // the button to trigger the action is disable
         modal.show() // show confirmation modal
     }
 }
+
+/**
+ * Submit the bulk form as a job and poll its status until it is finished.
+ * @param {HTMLFormElement} form Confirmation form with the action and the items.
+ */
+function submit_bulk_job(form) {
+    const progress = document.querySelector('div#bulk-job-progress');
+    const text = progress.querySelector('span#bulk-job-text');
+    const bar = progress.querySelector('div#bulk-job-bar');
+    const cancel_button = progress.querySelector('button#bulk-job-cancel');
+    const problems = progress.querySelector('ul#bulk-job-problems');
+    problems.innerHTML = '';
+    progress.classList.remove('d-none');
+    text.innerHTML = 'Starting ...';
+    fetch(form.action, { method: 'POST', body: new FormData(form), headers: { 'Accept': 'application/json' } })
+        .then((response) => {
+            if (!response.ok) {
+                throw new Error(`${response.status} ${response.statusText}`);
+            }
+            const status_url = response.headers.get('Location');
+            const csrf_token = form.querySelector('input[name="csrf_token"]').value;
+            cancel_button.onclick = () => fetch(`${status_url}/cancel`, { method: 'POST', headers: { 'X-CSRFToken': csrf_token } });
+            // the per item results only once the job is finished
+            const poll = () => fetch(`${status_url}?items=0`).then((response) => response.json()).then((job) => {
+                bar.style.width = `${job.total ? 100 * job.processed / job.total : 100}%`;
+                text.innerHTML = `${job.action}: ${job.processed} of ${job.total} items processed (${job.status})`;
+                if (['queued', 'running'].indexOf(job.status) > -1) {
+                    setTimeout(poll, 1000);
+                    return;
+                }
+                text.innerHTML = `${job.action} ${job.status}: ${job.succeeded} succeeded, ${job.failed} failed, ${job.skipped} skipped. <a href="">Reload</a>`;
+                cancel_button.classList.add('d-none');
+                fetch(status_url).then((response) => response.json()).then((job) => {
+                    job.items.filter((item) => item.message).forEach((item) => {
+                        const problem = document.createElement('li');
+                        problem.textContent = item.message;
+                        problems.appendChild(problem);
+                    });
+                });
+            });
+            cancel_button.classList.remove('d-none');
+            poll();
+        })
+        .catch((error) => { text.innerHTML = `Could not start the job: ${error}`; });
+}
 //#endregion
 
 //#region Class definitions
@@ -413,28 +482,35 @@ class TreeElement {
      * Instantiate the class to show and request information about a candidate destination.
      * @param {HTMLDivElement} button_group DOM element where the radio input of this element will be added to.
      * @param {String} path Path of the collection to be added to the url.
+     * @param {Object} tree Node of this collection as returned for its parent, its children may be known already.
      */
-    constructor(button_group, path = '') {
-        this.url = urls.getAttribute('tree') + path; // note: urls is defined at the top of this script
+    constructor(button_group, path = '', tree = null) {
+        // two levels per request, so the children of the children are known without asking
+        this.url = urls.getAttribute('tree') + path + '?depth=2'; // note: urls is defined at the top of this script
         this.button_group = button_group;
         this.spinner = button_group.querySelector('div#spinner-div');
+        this.tree = tree != null && tree.children != undefined ? tree : null;
         const xhr = new XMLHttpRequest();
-        xhr.addEventListener('load', () => this.build_tree(xhr.responseText));
+        xhr.addEventListener('load', () => this.build_tree(JSON.parse(xhr.responseText)));
         xhr.open('GET', this.url, false);
         this.xhr = xhr;
     }
 
-    /** Request information about the destination collection. */
+    /** Request information about the destination collection, unless the parent request returned it already. */
     fill() {
-        this.xhr.send();
+        if (this.tree != null) {
+            this.build_tree(this.tree);
+        } else {
+            this.xhr.send();
+        }
     }
 
     /**
      * Create the appropriate radio input for this collection.
-     * @param {String} text Response of the request about the destination collection.
+     * @param {Object} tree Information about the destination collection and its children.
      */
-    build_tree(text) {
-        const { path, name, children } = JSON.parse(text);
+    build_tree(tree) {
+        const { path, name, children } = tree;
         this.has_children = children.length > 0;
         if (this.has_children) {
             this.children = children;
@@ -524,7 +600,7 @@ class TreeElement {
         collapse.appendChild(sub_button_group);
 
         /** Set up the tree elements for each of the children, with the new button group and the parent path. */
-        this.branches = this.children.map((tree_element) => new TreeElement(sub_button_group, tree_element.path));
+        this.branches = this.children.map((tree_element) => new TreeElement(sub_button_group, tree_element.path, tree_element));
 
         // the events below have an if statement because otherwise the icons of the parent folders also change
         collapse.addEventListener('shown.bs.collapse', () => {